@@ -0,0 +1,71 @@
+"""Speed and accuracy of the approximate bilateral grid against OpenCV's exact bilateral filter.
+
+Usage: python benchmarks/bilateral.py --size 1080 --diameters 15 31 61 121 [--sigma-color 45 --sigma-space 45]
+
+Errors are mean and 99th percentile absolute differences from cv2.bilateralFilter in 0-255 units, next to how far
+the exact filter moved the image at all, so an error can be read as a fraction of the filter's own effect.
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from utils.bilateral_grid import bilateral_grid, opencv_sigmas  # noqa: E402
+
+
+def timed(fn, repeat):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return out, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1080, help='frame height, width is 16:9')
+    parser.add_argument('--diameters', type=int, nargs='+', default=[15, 31, 61, 121])
+    parser.add_argument('--sigma-color', type=float, default=45)
+    parser.add_argument('--sigma-space', type=float, default=45)
+    parser.add_argument('--noise', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    # Smooth colour regions with sharp edges between them, plus noise
+    height, width = args.size, args.size * 16 // 9
+    image = torch.rand(1, 3, 12, 20)
+    image = torch.nn.functional.interpolate(image, size=(height, width), mode='nearest')
+    image = torch.nn.functional.avg_pool2d(image, 5, stride=1, padding=2, count_include_pad=False)
+    image = (image + args.noise * torch.randn(1, 1, height, width)).clamp(0, 1).permute(0, 2, 3, 1)
+    frame = (image[0].numpy() * 255).round().astype(np.uint8)
+    image = torch.from_numpy(frame.astype(np.float32) / 255).unsqueeze(0).to(args.device)
+
+    print(f'{width}x{height}, sigma_color {args.sigma_color:g}, sigma_space {args.sigma_space:g}, on {args.device}')
+    print(f'{"d":>5} {"opencv ms":>10} {"grid ms":>10} {"mean err":>9} {"p99 err":>9} {"filter moved":>13}')
+    for diameter in args.diameters:
+        reference, opencv_seconds = timed(
+            lambda: cv2.bilateralFilter(frame, diameter, args.sigma_color, args.sigma_space), args.repeat)
+        sigmas = opencv_sigmas(diameter, args.sigma_color, args.sigma_space)
+        out, grid_seconds = timed(lambda: bilateral_grid(image, *sigmas), args.repeat)
+
+        reference = reference.astype(np.float32)
+        error = np.abs(out[0].cpu().numpy() * 255 - reference)
+        moved = np.abs(frame.astype(np.float32) - reference).mean()
+        print(f'{diameter:>5} {opencv_seconds * 1000:>10.1f} {grid_seconds * 1000:>10.1f} '
+              f'{error.mean():>9.2f} {np.percentile(error, 99):>9.2f} {moved:>13.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Accuracy versus speed of the ImageFilters Gaussian blur modes, with PIL's GaussianBlur for reference.
+
+Usage: python benchmarks/gaussian_blur.py --frames 4 --size 1024 --sigmas 1 4 16 64 256 [--device cuda]
+
+Errors are measured against an exact float64 separable convolution, so ``direct`` shows the float32 floor.
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from PIL import ImageFilter  # noqa: E402
+from utils.convert import pil2tensor, tensor2pil  # noqa: E402
+from utils.filters import gaussian_blur, gaussian_blur_direct  # noqa: E402
+
+
+def timed(fn, repeat):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return out, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=4)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--sigmas', type=float, nargs='+', default=[1, 4, 16, 64, 256])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    # Low frequency noise looks more like a photo than white noise does
+    images = torch.rand(args.frames, 3, args.size // 16, args.size // 16)
+    images = torch.nn.functional.interpolate(images, size=(args.size, args.size), mode='bicubic').clamp(0, 1)
+    images = images.to(args.device)
+
+    print(f'{args.frames} frames of {args.size}x{args.size} on {args.device}')
+    print(f'{"sigma":>7} {"mode":<8} {"ms":>10} {"max err":>10} {"mean err":>10}')
+    for sigma in args.sigmas:
+        reference = gaussian_blur_direct(images.double(), sigma).float()
+
+        for mode in ('direct', 'box', 'fft', 'auto'):
+            out, seconds = timed(lambda: gaussian_blur(images, sigma, mode), args.repeat)
+            error = (out - reference).abs()
+            print(f'{sigma:>7g} {mode:<8} {seconds * 1000:>10.1f} {error.max():>10.5f} {error.mean():>10.6f}')
+
+        def pil_path():
+            frames = images.permute(0, 2, 3, 1).cpu()
+            blurred = [pil2tensor(tensor2pil(img).filter(ImageFilter.GaussianBlur(sigma))) for img in frames]
+            return torch.cat(blurred, dim=0).permute(0, 3, 1, 2).to(args.device)
+
+        out, seconds = timed(pil_path, args.repeat)
+        error = (out - reference).abs()
+        print(f'{sigma:>7g} {"pil":<8} {seconds * 1000:>10.1f} {error.max():>10.5f} {error.mean():>10.6f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark the torch LUT engine against the PIL (Luts) and colour (LutsAdvanced) paths.
+
+Usage: python benchmarks/luts.py --lut "assets/luts/Cinematic.cube" --frames 16 --size 512 [--device cuda]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from utils.convert import pil2tensor, tensor2pil  # noqa: E402
+from utils.lut import get_lut  # noqa: E402
+from utils.lut_engine import apply_lut  # noqa: E402
+
+
+def timed(fn, repeat):
+    fn()  # warm up caches and kernels
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return out, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lut', default=os.path.join(ROOT, 'assets', 'luts', 'Cinematic.cube'))
+    parser.add_argument('--frames', type=int, default=16)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    images = torch.rand(args.frames, args.size, args.size, 3)
+    lut = get_lut(args.lut)
+
+    def pil_path():
+        return torch.cat([pil2tensor(tensor2pil(img).filter(lut.filter)) for img in images], dim=0)
+
+    def colour_path():
+        return torch.stack([torch.from_numpy(lut.lut3d.apply(img.numpy())) for img in images])
+
+    device_images = images.to(args.device)
+    table = lut.tensor(args.device)
+
+    results = [
+        ('pil (uint8)', *timed(pil_path, args.repeat)),
+        ('colour', *timed(colour_path, args.repeat)),
+    ]
+    for interpolation in ('trilinear', 'tetrahedral'):
+        out, seconds = timed(lambda: apply_lut(device_images, table, lut.domain, interpolation), args.repeat)
+        results.append((f'torch {interpolation} ({args.device})', out.cpu(), seconds))
+
+    reference = results[1][1].float()
+    print(f'{args.frames} frames of {args.size}x{args.size}, LUT size {lut.size}')
+    for name, out, seconds in results:
+        error = np.abs(out.float().numpy() - reference.numpy()).max()
+        print(f'{name:<28} {seconds * 1000:9.1f} ms  {args.frames / seconds:8.1f} fps  max err vs colour {error:.5f}')
+
+
+if __name__ == '__main__':
+    main()
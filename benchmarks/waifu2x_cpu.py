@@ -0,0 +1,82 @@
+"""Frames per second of Waifu2x on the CPU for each execution configuration.
+
+Usage: python benchmarks/waifu2x_cpu.py --size 540 --frames 4 --scale 2 --threads 0 8 16 [--model-type art]
+
+Configurations build on each other: fp32 is the plain model, channels_last converts the weights to NHWC, bf16 adds
+bfloat16 autocast (skipped when the CPU has no native bf16) and compile adds torch.compile. Every configuration is
+warmed up on one frame first, so compile time is not counted. Loads the pinned install from models/waifu2x when
+scripts/install_waifu2x.py has been run, and nagadomi/nunif:dev through torch.hub when SHIBIKO_WAIFU2X_HUB=1 is set.
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from utils.waifu2x import cpu_supports_bf16, get_waifu2x, infer, intra_op_threads, unload_waifu2x  # noqa: E402
+
+METHODS = {1: 'noise', 2: 'noise_scale', 4: 'noise_scale4x'}
+CONFIGS = [
+    ('fp32', False, False, False),
+    ('channels_last', True, False, False),
+    ('bf16', True, True, False),
+    ('compile', True, False, True),
+    ('bf16+compile', True, True, True),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=540, help='frame height, width is 16:9')
+    parser.add_argument('--frames', type=int, default=4)
+    parser.add_argument('--scale', type=int, choices=sorted(METHODS), default=2)
+    parser.add_argument('--noise-level', type=int, default=1)
+    parser.add_argument('--model-type', default='art')
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--threads', type=int, nargs='+', default=[0], help='intra-op threads, 0 is torch default')
+    parser.add_argument('--configs', nargs='+', default=[name for name, *_ in CONFIGS],
+                        choices=[name for name, *_ in CONFIGS])
+    args = parser.parse_args()
+
+    height, width = args.size, args.size * 16 // 9
+    frames = torch.rand(args.frames, 3, height, width)
+    method = METHODS[args.scale]
+    bf16_supported = cpu_supports_bf16()
+
+    print(f'{width}x{height} x{args.scale} {args.model_type} {method}, {args.frames} frames, '
+          f'cpu {torch.backends.cpu.get_cpu_capability()}, native bf16 {bf16_supported}')
+    print(f'{"config":>14} {"threads":>8} {"fps":>8} {"ms/frame":>9} {"max diff":>9}')
+    for threads in args.threads:
+        with intra_op_threads(threads):
+            reference = None
+            for name, channels_last, bf16, compiled in CONFIGS:
+                if name not in args.configs:
+                    continue
+                if bf16 and not bf16_supported:
+                    print(f'{name:>14} {torch.get_num_threads():>8} {"skipped, no native bf16":>28}')
+                    continue
+                model = get_waifu2x(args.model_type, method, args.noise_level, device='cpu',
+                                    batch_size=args.batch_size, tile_size=args.tile_size,
+                                    channels_last=channels_last, compiled=compiled, bf16=bf16,
+                                    max_models=1)
+                infer(model, frames[0], method, args.noise_level, bf16)
+
+                start = time.perf_counter()
+                outputs = [infer(model, frame, method, args.noise_level, bf16) for frame in frames]
+                seconds = time.perf_counter() - start
+
+                out = torch.stack(outputs)
+                reference = out if reference is None else reference
+                diff = (out - reference).abs().max().item()
+                print(f'{name:>14} {torch.get_num_threads():>8} {args.frames / seconds:>8.2f} '
+                      f'{seconds / args.frames * 1000:>9.1f} {diff:>9.4f}')
+        unload_waifu2x()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,21 @@
 import cv2
 import numpy as np
-import re
-import os
 import torch
 from typing import Optional
+from ..utils.assets import AssetIndex, describe_cascade
 from ..utils.directory import initialize_directory
 
+# User cascades shadow the ones bundled with OpenCV, which are listed without their haarcascade_ prefix
+cascade_index = AssetIndex([initialize_directory('cascades'), cv2.data.haarcascades], ".xml", describe_cascade,
+                           prefixes={cv2.data.haarcascades: 'haarcascade_'})
+
 
 class Cascade:
-    cascades_directory = initialize_directory('cascades')
+    cascades_directory = cascade_index.directories[0]
 
     @classmethod
     def INPUT_TYPES(cls):
-        cascades = [cascade.split(".")[0] for cascade in os.listdir(cls.cascades_directory) if cascade.endswith(".xml")]
-        embedded = [re.sub(r'haarcascade_|.xml', '', cascade) for cascade in os.listdir(cv2.data.haarcascades) if cascade.endswith(".xml")]
-
-        cascades.extend(embedded)
-        cascades.sort()
+        cascades = cascade_index.names()
 
         return {
             "required": {
@@ -47,16 +46,12 @@ class Cascade:
 
     def load(self, cascade='frontalface_default'):
         self.cascade = cascade
-        self.cascades_directory = initialize_directory('cascades')
-
-        cascade_path = os.path.join(self.cascades_directory, f'{cascade}.xml')
-        if os.path.exists(self.cascades_directory) and os.path.exists(cascade_path):
-            self.haar_cascade_face = cv2.CascadeClassifier(cascade_path)
-        elif cv2.data.haarcascades not in cascade and 'haarcascade_' not in cascade:
-            cascade_path = os.path.join(cv2.data.haarcascades, f'haarcascade_{cascade}.xml')
-            self.haar_cascade_face = cv2.CascadeClassifier(cascade_path)
-        else:
+        self.cascades_directory = cascade_index.directories[0]
+
+        cascade_path = cascade_index.path(cascade)
+        if cascade_path is None:
             raise ValueError('Invalid cascade path or name')
+        self.haar_cascade_face = cv2.CascadeClassifier(cascade_path)
 
     def detect(self, image):
         if len(image.shape) > 2:
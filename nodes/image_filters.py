@@ -1,7 +1,7 @@
-import numpy as np
 import torch
 from PIL import Image, ImageEnhance, ImageFilter
 from ..utils.convert import tensor2pil, pil2tensor
+from ..utils.filters import GAUSSIAN_MODES, apply_filters
 
 
 # From the original code of WAS Node Suite with some additions and modifications
@@ -26,6 +26,11 @@ class ImageFilters:
                 "edge_enhance": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.01}),
                 "detail_enhance": (["false", "true"],),
             },
+            "optional": {
+                "backend": (["torch", "pil"], {"default": "torch"}),
+                "fuse_kernels": ("BOOLEAN", {"default": True}),
+                "gaussian_mode": (GAUSSIAN_MODES, {"default": "auto"}),
+            },
         }
 
     CATEGORY = "Shibiko AI"
@@ -48,178 +53,87 @@ class ImageFilters:
                  gaussian_blur=0.0,
                  edge_enhance=0.0,
                  detail_enhance=False,
+                 backend="torch",
+                 fuse_kernels=True,
+                 gaussian_mode="auto",
                  **kwargs):
-        tensors = []
-        if len(image) > 1:
-            for img in image:
-
-                pil_image = None
-
-                # Apply NP Adjustments
-                if brightness > 0.0 or brightness < 0.0:
-                    # Apply brightness
-                    img = np.clip(img + brightness, 0.0, 1.0)
-
-                if contrast > 1.0 or contrast < 1.0:
-                    # Apply contrast
-                    img = np.clip(img * contrast, 0.0, 1.0)
-
-                # Apply PIL Adjustments
-                if saturation > 1.0 or saturation < 1.0:
-                    # PIL Image
-                    pil_image = tensor2pil(img)
-                    # Apply saturation
-                    pil_image = ImageEnhance.Color(pil_image).enhance(saturation)
-
-                if sharpness > 1.0 or sharpness < 1.0:
-                    # Assign or create PIL Image
-                    pil_image = pil_image if pil_image else tensor2pil(img)
-                    # Apply sharpness
-                    pil_image = ImageEnhance.Sharpness(pil_image).enhance(sharpness)
-
-                if blur > 0:
-                    # Assign or create PIL Image
-                    pil_image = pil_image if pil_image else tensor2pil(img)
-                    # Apply blur
-                    for _ in range(blur):
-                        pil_image = pil_image.filter(ImageFilter.BLUR)
-
-                if sharpen > 0:
-                    # Assign or create PIL Image
-                    pil_image = pil_image if pil_image else tensor2pil(img)
-                    # Apply blur
-                    for _ in range(sharpen):
-                        pil_image = pil_image.filter(ImageFilter.SHARPEN)
-
-                if smooth > 0:
-                    # Assign or create PIL Image
-                    pil_image = pil_image if pil_image else tensor2pil(img)
-                    # Apply blur
-                    for _ in range(smooth):
-                        pil_image = pil_image.filter(ImageFilter.SMOOTH)
-
-                if smooth_more > 0:
-                    # Assign or create PIL Image
-                    pil_image = pil_image if pil_image else tensor2pil(img)
-                    # Apply blur
-                    for _ in range(smooth_more):
-                        pil_image = pil_image.filter(ImageFilter.SMOOTH_MORE)
-
-                if gaussian_blur > 0.0:
-                    # Assign or create PIL Image
-                    pil_image = pil_image if pil_image else tensor2pil(img)
-                    # Apply Gaussian blur
-                    pil_image = pil_image.filter(ImageFilter.GaussianBlur(radius=gaussian_blur))
-
-                if edge_enhance > 0.0:
-                    # Assign or create PIL Image
-                    pil_image = pil_image if pil_image else tensor2pil(img)
-                    # Edge Enhancement
-                    edge_enhanced_img = pil_image.filter(ImageFilter.EDGE_ENHANCE_MORE)
-                    # Blend Mask
-                    blend_mask = Image.new(mode="L", size=pil_image.size, color=(round(edge_enhance * 255)))
-                    # Composite Original and Enhanced Version
-                    pil_image = Image.composite(edge_enhanced_img, pil_image, blend_mask)
-                    # Clean-up
-                    del blend_mask, edge_enhanced_img
-
-                if detail_enhance == "true" or detail_enhance is True:
-                    pil_image = pil_image if pil_image else tensor2pil(img)
-                    pil_image = pil_image.filter(ImageFilter.DETAIL)
-
-                # Output image
-                out_image = (pil2tensor(pil_image) if pil_image else img.unsqueeze(0))
-
-                tensors.append(out_image)
-
-            tensors = torch.cat(tensors, dim=0)
-
-        else:
-
-            pil_image = None
-            img = image
-
-            # Apply NP Adjustments
-            if brightness > 0.0 or brightness < 0.0:
-                # Apply brightness
-                img = np.clip(img + brightness, 0.0, 1.0)
-
-            if contrast > 1.0 or contrast < 1.0:
-                # Apply contrast
-                img = np.clip(img * contrast, 0.0, 1.0)
-
-            # Apply PIL Adjustments
-            if saturation > 1.0 or saturation < 1.0:
-                # PIL Image
-                pil_image = tensor2pil(img)
-                # Apply saturation
-                pil_image = ImageEnhance.Color(pil_image).enhance(saturation)
-
-            if sharpness > 1.0 or sharpness < 1.0:
-                # Assign or create PIL Image
-                pil_image = pil_image if pil_image else tensor2pil(img)
-                # Apply sharpness
-                pil_image = ImageEnhance.Sharpness(pil_image).enhance(sharpness)
-
-            if blur > 0:
-                # Assign or create PIL Image
-                pil_image = pil_image if pil_image else tensor2pil(img)
-                # Apply blur
-                for _ in range(blur):
-                    pil_image = pil_image.filter(ImageFilter.BLUR)
-
-            if sharpen > 0:
-                # Assign or create PIL Image
-                pil_image = pil_image if pil_image else tensor2pil(img)
-                # Apply blur
-                for _ in range(sharpen):
-                    pil_image = pil_image.filter(ImageFilter.SHARPEN)
-
-            if smooth > 0:
+        detail_enhance = detail_enhance == "true" or detail_enhance is True
+
+        if backend == "torch":
+            # Whole batch at once, in float, on the image's device
+            return (apply_filters(image, brightness, contrast, saturation, sharpness, blur, sharpen, smooth,
+                                  smooth_more, gaussian_blur, edge_enhance, detail_enhance, fuse_kernels,
+                                  gaussian_mode),)
+
+        images = image if image.dim() == 4 else image.unsqueeze(0)
+        tensors = [
+            self.apply_pil(img, brightness, contrast, saturation, sharpness, blur, sharpen, smooth, smooth_more,
+                           gaussian_blur, edge_enhance, detail_enhance)
+            for img in images
+        ]
+
+        return (torch.cat(tensors, dim=0), )
+
+    @staticmethod
+    def apply_pil(img, brightness, contrast, saturation, sharpness, blur, sharpen, smooth, smooth_more,
+                  gaussian_blur, edge_enhance, detail_enhance):
+        pil_image = None
+
+        # Apply tensor adjustments
+        if brightness > 0.0 or brightness < 0.0:
+            # Apply brightness
+            img = torch.clamp(img + brightness, 0.0, 1.0)
+
+        if contrast > 1.0 or contrast < 1.0:
+            # Apply contrast
+            img = torch.clamp(img * contrast, 0.0, 1.0)
+
+        # Apply PIL Adjustments
+        if saturation > 1.0 or saturation < 1.0:
+            # PIL Image
+            pil_image = tensor2pil(img)
+            # Apply saturation
+            pil_image = ImageEnhance.Color(pil_image).enhance(saturation)
+
+        if sharpness > 1.0 or sharpness < 1.0:
+            # Assign or create PIL Image
+            pil_image = pil_image if pil_image else tensor2pil(img)
+            # Apply sharpness
+            pil_image = ImageEnhance.Sharpness(pil_image).enhance(sharpness)
+
+        for passes, kernel in ((blur, ImageFilter.BLUR), (sharpen, ImageFilter.SHARPEN),
+                               (smooth, ImageFilter.SMOOTH), (smooth_more, ImageFilter.SMOOTH_MORE)):
+            if passes > 0:
                 # Assign or create PIL Image
                 pil_image = pil_image if pil_image else tensor2pil(img)
-                # Apply blur
-                for _ in range(smooth):
-                    pil_image = pil_image.filter(ImageFilter.SMOOTH)
-
-            if smooth_more > 0:
-                # Assign or create PIL Image
-                pil_image = pil_image if pil_image else tensor2pil(img)
-                # Apply blur
-                for _ in range(smooth_more):
-                    pil_image = pil_image.filter(ImageFilter.SMOOTH_MORE)
-
-            if gaussian_blur > 0.0:
-                # Assign or create PIL Image
-                pil_image = pil_image if pil_image else tensor2pil(img)
-                # Apply Gaussian blur
-                pil_image = pil_image.filter(
-                    ImageFilter.GaussianBlur(radius=gaussian_blur))
-
-            if edge_enhance > 0.0:
-                # Assign or create PIL Image
-                pil_image = pil_image if pil_image else tensor2pil(img)
-                # Edge Enhancement
-                edge_enhanced_img = pil_image.filter(ImageFilter.EDGE_ENHANCE_MORE)
-                # Blend Mask
-                blend_mask = Image.new(
-                    mode="L", size=pil_image.size, color=(round(edge_enhance * 255)))
-                # Composite Original and Enhanced Version
-                pil_image = Image.composite(
-                    edge_enhanced_img, pil_image, blend_mask)
-                # Clean-up
-                del blend_mask, edge_enhanced_img
-
-            if detail_enhance == "true":
-                pil_image = pil_image if pil_image else tensor2pil(img)
-                pil_image = pil_image.filter(ImageFilter.DETAIL)
-
-            # Output image
-            out_image = (pil2tensor(pil_image) if pil_image else img)
-
-            tensors = out_image
-
-        return (tensors, )
+                # Apply the kernel once per pass
+                for _ in range(passes):
+                    pil_image = pil_image.filter(kernel)
+
+        if gaussian_blur > 0.0:
+            # Assign or create PIL Image
+            pil_image = pil_image if pil_image else tensor2pil(img)
+            # Apply Gaussian blur
+            pil_image = pil_image.filter(ImageFilter.GaussianBlur(radius=gaussian_blur))
+
+        if edge_enhance > 0.0:
+            # Assign or create PIL Image
+            pil_image = pil_image if pil_image else tensor2pil(img)
+            # Edge Enhancement
+            edge_enhanced_img = pil_image.filter(ImageFilter.EDGE_ENHANCE_MORE)
+            # Blend Mask
+            blend_mask = Image.new(mode="L", size=pil_image.size, color=(round(edge_enhance * 255)))
+            # Composite Original and Enhanced Version
+            pil_image = Image.composite(edge_enhanced_img, pil_image, blend_mask)
+            # Clean-up
+            del blend_mask, edge_enhanced_img
+
+        if detail_enhance:
+            pil_image = pil_image if pil_image else tensor2pil(img)
+            pil_image = pil_image.filter(ImageFilter.DETAIL)
+
+        # Output image
+        return pil2tensor(pil_image) if pil_image else img.unsqueeze(0)
 
 
 NODE_CLASS_MAPPINGS = {"ImageFilters": ImageFilters}
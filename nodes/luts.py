@@ -4,25 +4,35 @@ import folder_paths
 import numpy as np
 import torch
 from pathlib import Path
-from PIL import ImageFilter
-from colour.io.luts.iridas_cube import read_LUT_IridasCube
-from typing import List, Union
+from typing import Union
+from ..utils.assets import AssetIndex, describe_lut
 from ..utils.convert import convert, tensor2pil, pil2tensor
 from ..utils.directory import initialize_directory
+from ..utils.lut import get_lut, get_lut_stack
+from ..utils.lut_engine import INTERPOLATIONS, apply_lut
+
+
+# Every LUT node lists and resolves its files through this index instead of listing the folders on each refresh
+lut_index = AssetIndex([initialize_directory('luts'), os.path.join(folder_paths.models_dir, "luts")], ".cube", describe_lut)
 
 
 class Luts:
-    luts_directory = initialize_directory('luts')
+    luts_directory = lut_index.directories[0]
 
     @classmethod
     def INPUT_TYPES(cls):
-        luts = [lut.split(".")[0] for lut in os.listdir(cls.luts_directory) if lut.endswith(".cube")]
+        luts = lut_index.names()
 
         return {
             "required": {
                 "image": ("IMAGE",),
                 "lut": (luts, {"default": 'Cinematic'}),
             },
+            "optional": {
+                "backend": (["torch", "pil"], {"default": "torch"}),
+                "interpolation": (INTERPOLATIONS, {"default": "trilinear"}),
+                "precision": (["float32", "float16"], {"default": "float32"}),
+            },
         }
 
     CATEGORY = "Shibiko AI"
@@ -32,13 +42,14 @@ class Luts:
 
     FUNCTION = "__call__"
 
+    def lut_path(self, lut):
+        path = lut_index.path(lut)
+        if path is None:
+            path = os.path.join(self.luts_directory, lut if lut.endswith(".cube") else lut + ".cube")
+        return path
+
     def apply_lut(self, image, lut):
-        if not lut.endswith(".cube"):
-            lut += ".cube"
-        lut_file_name = lut
-        lut_directory = initialize_directory('luts')
-        lut_path = os.path.join(lut_directory, lut_file_name)
-        lut_filter = self.read_lut(lut_path)
+        lut_filter = self.read_lut(self.lut_path(lut))
 
         # Convert tensor to PIL, apply LUT, then convert back to tensor
         if isinstance(image, torch.Tensor):
@@ -50,33 +61,17 @@ class Luts:
         return image
 
     def read_lut(self, path_lut: Union[str, os.PathLike], num_channels: int = 3):
-        """Read LUT from raw file. Assumes each line in a file is part of the lut table"""
-        with open(path_lut) as f:
-            lut_raw = f.read().splitlines()
-
-        size = round(len(lut_raw) ** (1 / 3))
-        lut_table = [
-            self.row2val(row.split(" ")) for row in lut_raw if self.is_3D_lut_row(row.split(" "))
-        ]
-
-        return ImageFilter.Color3DLUT(size, lut_table, num_channels)
-
-    @staticmethod
-    def is_3D_lut_row(row: List) -> bool:
-        """Check if one line in the file has exactly 3 values"""
-        row_values = []
-        for val in row:
-            try:
-                row_values.append(float(val))
-            except ValueError:
-                return False
-        return len(row_values) == 3
-
-    @staticmethod
-    def row2val(row):
-        return tuple([float(val) for val in row])
-
-    def __call__(self, image, lut, **kwargs):
+        """Read LUT from the shared cache, parsing the file only on first use or after it changed"""
+        return get_lut(path_lut).filter
+
+    def __call__(self, image, lut, backend="torch", interpolation="trilinear", precision="float32", **kwargs):
+        if backend == "torch":
+            # Grade the whole batch on the image's device without a uint8 round trip, alpha is kept as is
+            batch = image if image.dim() == 4 else image.unsqueeze(0)
+            lut_table = get_lut(self.lut_path(lut)).tensor(image.device)
+            dtype = torch.float16 if precision == "float16" else torch.float32
+            return (apply_lut(batch, lut_table, interpolation=interpolation, dtype=dtype).clamp_(0, 1),)
+
         # Handle single image or batch
         if image.dim() == 3:  # Single image (H, W, C)
             images = [image]
@@ -114,13 +109,19 @@ class Luts:
 class LutsAdvanced:
     @classmethod
     def INPUT_TYPES(s):
+        luts = lut_index.names(extension=True)
+
         return {
             "required": {
                 "image": ("IMAGE",),
-                "lut_file": (os.listdir(os.path.join(folder_paths.models_dir, "luts")), {"default": "Cinematic.cube"}),
+                "lut_file": (luts, {"default": "Cinematic.cube"}),
                 "gamma_correction": ("BOOLEAN", {"default": True}),
                 "clip_values": ("BOOLEAN", {"default": True}),
                 "strength": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.1}),
+            },
+            "optional": {
+                "backend": (["torch", "colour"], {"default": "torch"}),
+                "interpolation": (INTERPOLATIONS, {"default": "trilinear"}),
             }}
 
     CATEGORY = "Shibiko AI"
@@ -131,28 +132,20 @@ class LutsAdvanced:
     FUNCTION = "__call__"
 
     # TODO: check if we can do without numpy
-    def __call__(self, image, lut_file="cinematic", gamma_correction=True, clip_values=True, strength=1.0):
-        lut_file_path = folder_paths.get_full_path("luts", lut_file + '.cube')
+    def __call__(self, image, lut_file="cinematic", gamma_correction=True, clip_values=True, strength=1.0,
+                 backend="torch", interpolation="trilinear"):
+        lut_file_path = lut_index.path(lut_file)
         if not lut_file_path or not Path(lut_file_path).exists():
             print(f"Could not find LUT file: {lut_file_path}")
             return (image,)
 
         device = image.device
-        lut = read_LUT_IridasCube(lut_file_path)
-        lut.name = lut_file
-
-        if clip_values:
-            if lut.domain[0].max() == lut.domain[0].min() and lut.domain[1].max() == lut.domain[1].min():
-                lut.table = np.clip(lut.table, lut.domain[0, 0], lut.domain[1, 0])
-            else:
-                for dim in range(3):
-                    domain0 = lut.domain[0, dim]
-                    domain1 = lut.domain[1, dim]
-
-                    if len(lut.table.shape) == 2:
-                        lut.table[:, dim] = np.clip(lut.table[:, dim], domain0, domain1)
-                    else:  # 3D
-                        lut.table[:, :, :, dim] = np.clip(lut.table[:, :, :, dim], domain0, domain1)
+        lut_entry = get_lut(lut_file_path, clip_values)
+        if backend == "torch":
+            out = apply_lut(image, lut_entry.tensor(device), lut_entry.domain, interpolation, strength, gamma_correction)
+            return (out,)
+
+        lut = lut_entry.lut3d
 
         out = []
         for img in image:  # TODO: is this more resource efficient? should we use a batch instead?
@@ -184,11 +177,65 @@ class LutsAdvanced:
         return (out,)
 
 
+class LutStack:
+    """Bakes an ordered stack of LUTs, each with its own strength, gamma and clip settings, into one table."""
+    max_luts = 4
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        luts = ["None"] + lut_index.names(extension=True)
+
+        optional = {}
+        for i in range(1, cls.max_luts + 1):
+            optional[f"lut_{i}"] = (luts, {"default": "None"})
+            optional[f"strength_{i}"] = ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.1})
+            optional[f"gamma_correction_{i}"] = ("BOOLEAN", {"default": False})
+            optional[f"clip_values_{i}"] = ("BOOLEAN", {"default": True})
+
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "resolution": ("INT", {"default": 33, "min": 2, "max": 129, "step": 1}),
+                "interpolation": (INTERPOLATIONS, {"default": "trilinear"}),
+            },
+            "optional": optional,
+        }
+
+    CATEGORY = "Shibiko AI"
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("image",)
+
+    FUNCTION = "__call__"
+
+    def __call__(self, image, resolution=33, interpolation="trilinear", **kwargs):
+        stages = []
+        for i in range(1, self.max_luts + 1):
+            lut_path = lut_index.path(kwargs.get(f"lut_{i}", "None"))
+            if lut_path is None:
+                continue
+            stages.append((
+                lut_path,
+                kwargs.get(f"strength_{i}", 1.0),
+                kwargs.get(f"gamma_correction_{i}", False),
+                kwargs.get(f"clip_values_{i}", True),
+            ))
+
+        if not stages:
+            return (image,)
+
+        # The stack is baked once per combination and then costs a single lookup per pixel
+        lut_table = get_lut_stack(stages, resolution, interpolation, image.device)
+        return (apply_lut(image, lut_table, interpolation=interpolation),)
+
+
 NODE_CLASS_MAPPINGS = {
     "Luts": Luts,
-    "LutsAdvanced": LutsAdvanced
+    "LutsAdvanced": LutsAdvanced,
+    "LutStack": LutStack
 }
 NODE_DISPLAY_NAME_MAPPINGS = {
     "Luts": "Shibiko AI - Luts",
-    "LutsAdvanced": "Shibiko AI - Luts (Advanced)"
+    "LutsAdvanced": "Shibiko AI - Luts (Advanced)",
+    "LutStack": "Shibiko AI - Luts (Stack)"
 }
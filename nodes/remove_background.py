@@ -1,8 +1,13 @@
-import os
+import numpy as np
 import torch
-import folder_paths
-from rembg import remove, new_session
+from PIL import Image
+from rembg.bg import alpha_matting_cutout, apply_background_color, naive_cutout, post_process, putalpha_cutout
 from ..utils.convert import pil2tensor, tensor2pil
+from ..utils.matting import fast_alpha_matting
+from ..utils.pipeline import Pipeline
+from ..utils.segmentation import MODEL_INPUTS, composite, predictions_to_masks, preprocess, run_session
+from ..utils.sessions import get_session, unload_sessions
+from ..utils.temporal import plan_keyframes, warp_mask
 from comfy.utils import ProgressBar
 
 
@@ -26,12 +31,30 @@ class RemoveBackground:
                 "background_color": (["none", "black", "white", "magenta", "chroma green", "chroma blue"],),
                 "putalpha": ("BOOLEAN", {"default": False},),
             },
+            "optional": {
+                # Models kept resident across runs, the least recently used one is unloaded past this
+                "max_models": ("INT", {"default": 2, "min": 1, "max": 16, "step": 1}),
+                "keep_model_loaded": ("BOOLEAN", {"default": True},),
+                # Frames per ONNX run on the batched path, alpha matting always runs one frame at a time
+                "chunk_size": ("INT", {"default": 4, "min": 1, "max": 64, "step": 1}),
+                # fast solves the matte at 1/alpha_matting_downscale resolution inside the unknown band only
+                "alpha_matting_mode": (["full", "fast"], {"default": "full"}),
+                "alpha_matting_downscale": ("INT", {"default": 4, "min": 1, "max": 16, "step": 1}),
+                # mask only skips compositing and passes the input images through unchanged
+                "output": (["image and mask", "mask only"], {"default": "image and mask"}),
+                # Static camera video: reuse (shift-compensated) keyframe masks while frames barely change
+                "video_mode": ("BOOLEAN", {"default": False},),
+                # Largest low resolution 8x8 block mean change, in 0-255 units, that still reuses the keyframe
+                "reuse_threshold": ("FLOAT", {"default": 3.0, "min": 0.0, "max": 255.0, "step": 0.1}),
+                # Force fresh inference at least this often, 0 never forces it
+                "keyframe_interval": ("INT", {"default": 30, "min": 0, "max": 10000, "step": 1}),
+            },
         }
 
     CATEGORY = "Shibiko AI"
 
-    RETURN_TYPES = ("IMAGE",)
-    RETURN_NAMES = ("image",)
+    RETURN_TYPES = ("IMAGE", "MASK")
+    RETURN_NAMES = ("image", "mask")
 
     FUNCTION = "__call__"
 
@@ -77,6 +100,15 @@ class RemoveBackground:
         only_mask=False,
         background_color="none",
         putalpha=False,
+        max_models=2,
+        keep_model_loaded=True,
+        chunk_size=4,
+        alpha_matting_mode="full",
+        alpha_matting_downscale=4,
+        output="image and mask",
+        video_mode=False,
+        reuse_threshold=3.0,
+        keyframe_interval=30,
         **kwargs
     ):
         # ComfyUI will allow strings in place of booleans, validate the input.
@@ -85,9 +117,6 @@ class RemoveBackground:
         post_processing = post_processing if type(post_processing) is bool else self.__convertToBool(post_processing)
         only_mask = only_mask if type(only_mask) is bool else self.__convertToBool(only_mask)
 
-        os.environ['U2NET_HOME'] = os.path.join(folder_paths.models_dir, 'rembg')
-        os.makedirs(os.environ['U2NET_HOME'], exist_ok=True)
-
         # Set background color
         if background_color == "black":
             bgrgba = [0, 0, 0, 255]
@@ -105,29 +134,161 @@ class RemoveBackground:
         if transparency and bgrgba is not None:
             bgrgba[3] = 0
 
-        batch_tensor = []
-        pbar = ProgressBar(len(images))
-        for idx, image in enumerate(images):
-            pbar.update_absolute(idx, len(images), f"Removing background from image {idx + 1}/{len(images)}")
-            image = tensor2pil(image)
-            batch_tensor.append(pil2tensor(
-                remove(
-                    image,
-                    session=new_session(model),
-                    post_process_mask=post_processing,
-                    alpha_matting=alpha_matting,
-                    alpha_matting_foreground_threshold=alpha_matting_foreground_threshold,
-                    alpha_matting_background_threshold=alpha_matting_background_threshold,
-                    alpha_matting_erode_size=alpha_matting_erode_size,
-                    only_mask=only_mask,
-                    bgcolor=bgrgba,
-                    putalpha=putalpha,
-                )
-                .convert(('RGBA' if transparency else 'RGB'))))
-        pbar.update_absolute(len(images), len(images), "Complete")
-        batch_tensor = torch.cat(batch_tensor, dim=0)
-
-        return (batch_tensor,)
+        session = get_session(model, max_sessions=max_models)
+        mask_only = output == "mask only"
+
+        if model in MODEL_INPUTS and (not alpha_matting or alpha_matting_mode == "fast"):
+            matting = (alpha_matting_foreground_threshold, alpha_matting_background_threshold,
+                       alpha_matting_erode_size, alpha_matting_downscale) if alpha_matting else None
+            plan = plan_keyframes(images, reuse_threshold, keyframe_interval) if video_mode else None
+            batch_tensor, masks = self.remove_batched(images, session, model, chunk_size, post_processing,
+                                                      only_mask, putalpha, bgrgba, transparency, matting, mask_only,
+                                                      plan)
+            if plan is not None:
+                inferred = len({key for key, _ in plan})
+                print(f"\033[93m[Shibiko AI] \033[31mRemove background video mode: {inferred} frames inferred, "
+                      f"{len(plan) - inferred} reused\033[0m")
+        else:
+            if video_mode:
+                print("\033[93m[Shibiko AI] \033[31mVideo mode needs the batched path, full alpha matting "
+                      "infers every frame\033[0m")
+            batch_tensor, masks = self.remove_per_image(images, session, post_processing, alpha_matting,
+                                                        alpha_matting_foreground_threshold,
+                                                        alpha_matting_background_threshold, alpha_matting_erode_size,
+                                                        only_mask, bgrgba, putalpha, transparency, mask_only)
+
+        if not keep_model_loaded:
+            unload_sessions(model)
+
+        if mask_only:
+            batch_tensor = images
+
+        return (batch_tensor, masks)
+
+    @staticmethod
+    def remove_batched(images, session, model, chunk_size, post_processing, only_mask, putalpha, bgrgba,
+                       transparency, matting=None, mask_only=False, plan=None):
+        """Preprocess, infer and composite ``chunk_size`` frames at a time, straight into the output tensors.
+
+        The three stages run on their own threads, so the next chunk is preprocessed while this one is inferred.
+        ``plan`` comes from ``plan_keyframes``: only keyframes are inferred, and every other frame gets its
+        keyframe's mask shifted by the measured camera motion. Returns the images, or None with ``mask_only``,
+        and the masks.
+        """
+        total, height, width = images.shape[:3]
+        output = None if mask_only else torch.empty((total, height, width, 4 if transparency else 3),
+                                                    dtype=torch.float32)
+        mask_output = torch.empty((total, height, width), dtype=torch.float32)
+
+        if plan is None:
+            plan = [(idx, (0.0, 0.0)) for idx in range(total)]
+        keyframes = sorted({key for key, _ in plan})
+        # Frames from a keyframe up to the next one all reuse it
+        ends = keyframes[1:] + [total]
+
+        def prepare(start):
+            keys = keyframes[start:start + chunk_size]
+            return start, keys, preprocess(images[keys], model)
+
+        def infer(item):
+            start, keys, inputs = item
+            return start, keys, run_session(session, model, inputs, chunk_size)
+
+        def finish(item):
+            start, keys, predictions = item
+            key_masks = dict(zip(keys, predictions_to_masks(predictions, (height, width), post_processing).numpy()))
+            first, last = keys[0], ends[start + len(keys) - 1]
+            for begin in range(first, last, chunk_size):
+                end = min(begin + chunk_size, last)
+                masks = torch.from_numpy(np.stack([warp_mask(key_masks[plan[idx][0]], plan[idx][1])
+                                                   for idx in range(begin, end)]))
+                frames = images[begin:end].float().cpu()
+                frame_putalpha = putalpha
+                if matting is not None and not only_mask:
+                    frames, masks = RemoveBackground.fast_matting(frames, masks, matting, putalpha, not mask_only)
+                    # Matted frames hold their foreground colours, failed ones were already cut out
+                    frame_putalpha = True
+                mask_output[begin:end] = masks
+                if not mask_only:
+                    output[begin:end] = composite(frames, masks, only_mask, frame_putalpha, bgrgba, transparency)
+            return last
+
+        pipeline = Pipeline([("preprocess", prepare), ("inference", infer), ("composite", finish)])
+        RemoveBackground.run_pipeline(pipeline, range(0, len(keyframes), chunk_size), total)
+        return output, mask_output
+
+    @staticmethod
+    def fast_matting(frames, masks, matting, putalpha, estimate_foreground=True):
+        """Replace each frame with its matted foreground and each mask with its alpha.
+
+        Like rembg, a frame the solver rejects keeps the plain mask, cut out unless ``putalpha`` is set.
+        """
+        frames, masks = frames[..., :3].clone(), masks.clone()
+        for idx in range(len(frames)):
+            try:
+                foreground, alpha = fast_alpha_matting(frames[idx].numpy(), masks[idx].numpy(), *matting,
+                                                       estimate_foreground=estimate_foreground)
+                masks[idx] = torch.from_numpy(alpha)
+                if foreground is not None:
+                    frames[idx] = torch.from_numpy(foreground)
+            except ValueError:
+                if not putalpha:
+                    frames[idx] *= masks[idx].unsqueeze(-1)
+        return frames, masks
+
+    @staticmethod
+    def remove_per_image(images, session, post_processing, alpha_matting, alpha_matting_foreground_threshold,
+                         alpha_matting_background_threshold, alpha_matting_erode_size, only_mask, bgrgba, putalpha,
+                         transparency, mask_only=False):
+        """rembg's own per-image path, used for alpha matting, split into the same three pipelined stages"""
+        total, height, width = images.shape[:3]
+        output = None if mask_only else torch.empty((total, height, width, 4 if transparency else 3),
+                                                    dtype=torch.float32)
+        mask_output = torch.empty((total, height, width), dtype=torch.float32)
+
+        def prepare(idx):
+            return idx, tensor2pil(images[idx])
+
+        def infer(item):
+            idx, image = item
+            mask = session.predict(image)[0]
+            if post_processing:
+                mask = Image.fromarray(post_process(np.array(mask)))
+            return idx, image, mask
+
+        def finish(item):
+            idx, image, mask = item
+            if only_mask:
+                cutout = mask
+            elif alpha_matting:
+                try:
+                    cutout = alpha_matting_cutout(image, mask, alpha_matting_foreground_threshold,
+                                                  alpha_matting_background_threshold, alpha_matting_erode_size)
+                except ValueError:
+                    cutout = putalpha_cutout(image, mask) if putalpha else naive_cutout(image, mask)
+            else:
+                cutout = putalpha_cutout(image, mask) if putalpha else naive_cutout(image, mask)
+
+            alpha = cutout.getchannel('A') if cutout.mode == 'RGBA' and not only_mask else mask
+            mask_output[idx] = torch.from_numpy(np.asarray(alpha, dtype=np.float32) / 255.0)
+            if mask_only:
+                return idx + 1
+
+            if bgrgba is not None and not only_mask:
+                cutout = apply_background_color(cutout, bgrgba)
+            output[idx] = pil2tensor(cutout.convert('RGBA' if transparency else 'RGB'))[0]
+            return idx + 1
+
+        pipeline = Pipeline([("preprocess", prepare), ("inference", infer), ("composite", finish)])
+        RemoveBackground.run_pipeline(pipeline, range(total), total)
+        return output, mask_output
+
+    @staticmethod
+    def run_pipeline(pipeline, items, total):
+        pbar = ProgressBar(total)
+        for done in pipeline.run(items):
+            pbar.update_absolute(done, total, f"Removed background from {done}/{total} images")
+        print(f"\033[93m[Shibiko AI] \033[31mRemove background {total} images: {pipeline.summary()}\033[0m")
 
 
 NODE_CLASS_MAPPINGS = {"RemoveBackground": RemoveBackground}
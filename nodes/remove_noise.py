@@ -1,12 +1,20 @@
 # Original implementation from toyxyz/ComfyUI_toyxyz_test_nodes
 # Source: https://github.com/toyxyz/ComfyUI_toyxyz_test_nodes/blob/main/nodes/toyxyz_test_nodes.py
 
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import numpy as np
 import torch
 import cv2
 from comfy.utils import ProgressBar
+from ..utils.bilateral_grid import bilateral_grid, opencv_sigmas
+from ..utils.guided_filter import guided_filter
+from ..utils.temporal import changed_runs, tile_changes
 
 MAX_RESOLUTION = 8192
+GUIDED_BACKENDS = ["auto", "opencv", "torch"]
 
 
 class RemoveNoise:
@@ -27,6 +35,23 @@ class RemoveNoise:
                 "radius": ("INT", {"default": 4, "min": 0, "max": MAX_RESOLUTION, "step": 1}),
                 "eps": ("INT", {"default": 16, "min": 0, "max": MAX_RESOLUTION, "step": 1}),
             },
+            "optional": {
+                # 0 uses one worker per CPU core
+                "workers": ("INT", {"default": 0, "min": 0, "max": 256, "step": 1}),
+                # auto uses opencv-contrib's ximgproc.guidedFilter when it exists and no subsampling is asked for
+                "guided_backend": (GUIDED_BACKENDS, {"default": "auto"}),
+                # Fast guided filter: solve the coefficients at 1/subsample resolution (torch backend)
+                "guided_subsample": ("INT", {"default": 1, "min": 1, "max": 16, "step": 1}),
+                # Diameters above this use the approximate bilateral grid, whose cost does not grow with d. 0 never does
+                "bilateral_threshold": ("INT", {"default": 31, "min": 0, "max": MAX_RESOLUTION, "step": 1}),
+                # Video: reuse the previous frame's output on tiles that did not change and only filter the rest
+                "temporal": ("BOOLEAN", {"default": False}),
+                # Largest 8x8 block mean change, in 0-255 units, for a tile to count as static
+                "temporal_threshold": ("FLOAT", {"default": 3.0, "min": 0.0, "max": 255.0, "step": 0.1}),
+                "temporal_tile": ("INT", {"default": 64, "min": 16, "max": 1024, "step": 8}),
+                # Blend towards the previous output where frames barely differ, to reduce flicker
+                "temporal_blend": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.05}),
+            },
         }
 
     RETURN_TYPES = ("IMAGE",)
@@ -34,47 +59,198 @@ class RemoveNoise:
     CATEGORY = "Shibiko AI"
 
     def execute(self, image: torch.Tensor, bilateral_loop: int, d: int, sigma_color: int,
-                sigma_space: int, guided_loop: int, radius: int, eps: int, guided_first: bool):
+                sigma_space: int, guided_loop: int, radius: int, eps: int, guided_first: bool, workers: int = 0,
+                guided_backend: str = "auto", guided_subsample: int = 1, bilateral_threshold: int = 31,
+                temporal: bool = False, temporal_threshold: float = 3.0, temporal_tile: int = 64,
+                temporal_blend: float = 0.0):
 
         diameter = d
         if diameter % 2 == 0:
             diameter += 1
 
-        def sub(image: torch.Tensor):
-            guide = np.clip(255.0 * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8)
-            dst = guide.copy()
+        def bilateral(dst: np.ndarray):
+            for _ in range(bilateral_loop):
+                dst = cv2.bilateralFilter(dst, diameter, sigma_color, sigma_space)
+            return dst
+
+        def guided(guide: np.ndarray, dst: np.ndarray):
+            for _ in range(guided_loop):
+                dst = cv2.ximgproc.guidedFilter(guide, dst, radius, eps)
+            return dst
 
+        def sub(guide: np.ndarray):
+            dst = guide.copy()
             if guided_first:
-                if guided_loop > 0:
-                    for _ in range(guided_loop):
-                        dst = cv2.ximgproc.guidedFilter(guide, dst, radius, eps)
+                return bilateral(guided(guide, dst))
+            return guided(guide, bilateral(dst))
+
+        if image.dim() == 3:
+            image = image.unsqueeze(0)
+
+        torch_guided = guided_loop > 0 and self.guided_backend(guided_backend, guided_subsample) == "torch"
+        grid_bilateral = bilateral_loop > 0 and 0 < bilateral_threshold < diameter
+        grid_sigmas = opencv_sigmas(diameter, sigma_color, sigma_space) if grid_bilateral else None
+
+        # At least one stage runs on the whole batch in torch, the other runs per frame in OpenCV
+        def guided_batch(guide: torch.Tensor, x: torch.Tensor, progress: bool) -> torch.Tensor:
+            if torch_guided:
+                # ximgproc takes eps in 0-255 units
+                return guided_filter(guide, x, radius, eps / 255.0 ** 2, guided_loop, guided_subsample)
+            frames = list(zip(self.to_uint8(guide), self.to_uint8(x)))
+            return self.run_opencv(lambda pair: guided(*pair), frames, workers, x, progress)
+
+        def bilateral_batch(guide: torch.Tensor, x: torch.Tensor, progress: bool) -> torch.Tensor:
+            if grid_bilateral:
+                return bilateral_grid(x, *grid_sigmas, bilateral_loop)
+            return self.run_opencv(bilateral, self.to_uint8(x), workers, x, progress)
+
+        stages = []
+        if guided_loop > 0:
+            stages.append(guided_batch)
+        if bilateral_loop > 0:
+            stages.insert(len(stages) if guided_first else 0, bilateral_batch)
+
+        def process(batch: torch.Tensor, progress: bool = True) -> torch.Tensor:
+            if not torch_guided and not grid_bilateral:
+                # One uint8 conversion for the whole batch instead of one per frame
+                guides = self.to_uint8(batch)
+                output = np.empty_like(guides)
+                self.run_parallel(sub, guides, output, workers, progress)
+                return torch.from_numpy(output.astype(np.float32) / 255.0).to(batch.device)
+
+            x = batch.float()
+            for stage in stages:
+                x = stage(batch, x, progress).clamp(0, 1)
+            return x
+
+        if temporal and image.shape[0] > 1:
+            # How far each pass reads around a pixel. With the OpenCV bilateral and the full resolution guided filter,
+            # crops with this halo match full frame filtering up to one uint8 rounding step. The bilateral grid and the
+            # fast guided filter read through coarse cells (about 4 grid sigmas, one subsample), which the halo also
+            # covers, but those cells line up with the crop rather than the frame, so their crops stay approximate.
+            guided_reach = 2 * radius + (guided_subsample if torch_guided and guided_subsample > 1 else 0)
+            bilateral_reach = math.ceil(4 * grid_sigmas[0]) if grid_bilateral else diameter // 2
+            halo = guided_reach * guided_loop + bilateral_reach * bilateral_loop
+            return (self.execute_temporal(image, process, halo, temporal_threshold, temporal_tile, temporal_blend,
+                                          workers),)
+
+        return (process(image),)
 
-                if bilateral_loop > 0:
-                    for _ in range(bilateral_loop):
-                        dst = cv2.bilateralFilter(dst, diameter, sigma_color, sigma_space)
+    def execute_temporal(self, image: torch.Tensor, process, halo: int, threshold: float, tile: int,
+                         blend: float, workers: int = 0) -> torch.Tensor:
+        """Filter a batch of consecutive frames, recomputing only the tiles that changed.
+
+        Each tile remembers the input it was last filtered from, so slow drift is caught even when every step
+        between two frames is below the threshold. When more than half the tiles changed the whole frame is filtered.
+        Which tiles change depends only on the input, so the whole clip is planned first: the frames to refilter go
+        through ``process`` as one batch and the changed crops across the worker pool, then the output is assembled.
+        """
+        total, height, width = image.shape[:3]
+        reference = image[0].clone()
+
+        # Plan: frame 0 and frames with most tiles changed are refiltered, others only their changed runs
+        full, crops, boxes = [0], [], []
+        for idx in range(1, total):
+            frame = image[idx]
+            changed = tile_changes(frame, reference, tile) > threshold
+            if changed.float().mean() > 0.5:
+                full.append(idx)
+                reference.copy_(frame)
+                continue
+            for row, first, last in changed_runs(changed):
+                y0, y1 = row * tile, min(height, (row + 1) * tile)
+                x0, x1 = first * tile, min(width, last * tile)
+                cy0, cy1 = max(0, y0 - halo), min(height, y1 + halo)
+                cx0, cx1 = max(0, x0 - halo), min(width, x1 + halo)
+                crops.append(frame[cy0:cy1, cx0:cx1].unsqueeze(0))
+                boxes.append((idx, y0 - cy0, y1 - cy0, x0 - cx0, x1 - cx0, y0, y1, x0, x1))
+                reference[y0:y1, x0:x1] = frame[y0:y1, x0:x1]
+
+        filtered_frames = dict(zip(full, process(image[full])))
+        filtered_crops = [None] * len(crops)
+        if crops:
+            self.run_parallel(lambda crop: process(crop, progress=False)[0], crops, filtered_crops, workers)
+
+        output = torch.empty(image.shape, dtype=torch.float32, device=image.device)
+        crop_index = 0
+        for idx in range(total):
+            if idx in filtered_frames:
+                output[idx] = filtered_frames[idx]
             else:
-                if bilateral_loop > 0:
-                    for _ in range(bilateral_loop):
-                        dst = cv2.bilateralFilter(dst, diameter, sigma_color, sigma_space)
-
-                if guided_loop > 0:
-                    for _ in range(guided_loop):
-                        dst = cv2.ximgproc.guidedFilter(guide, dst, radius, eps)
-
-            return torch.from_numpy(dst.astype(np.float32) / 255.0).unsqueeze(0)
-
-        if len(image) > 1:
-            tensors = []
-            pbar = ProgressBar(len(image))
-            for idx, child in enumerate(image):
-                pbar.update_absolute(idx, len(image), f"Removing noise from image {idx + 1}/{len(image)}")
-                tensor = sub(child)
-                tensors.append(tensor)
-            pbar.update_absolute(len(image), len(image), "Complete")
-            return (torch.cat(tensors, dim=0),)
-        else:
-            tensor = sub(image)
-            return (tensor,)
+                output[idx] = output[idx - 1]
+                while crop_index < len(boxes) and boxes[crop_index][0] == idx:
+                    _, cy0, cy1, cx0, cx1, y0, y1, x0, x1 = boxes[crop_index]
+                    output[idx, y0:y1, x0:x1] = filtered_crops[crop_index][cy0:cy1, cx0:cx1]
+                    crop_index += 1
+
+            if blend > 0 and idx > 0:
+                # Full weight on static tiles, fading to none at four times the threshold
+                motion = tile_changes(image[idx], image[idx - 1], tile)
+                weight = blend * (1 - motion / (4 * max(threshold, 1e-3))).clamp(0, 1)
+                weight = torch.nn.functional.interpolate(weight[None, None], size=(height, width), mode="bilinear")
+                weight = weight[0, 0, :, :, None]
+                output[idx] = output[idx] * (1 - weight) + output[idx - 1] * weight
+        return output
+
+    @staticmethod
+    def to_uint8(x: torch.Tensor) -> np.ndarray:
+        return np.clip(255.0 * x.cpu().numpy(), 0, 255).astype(np.uint8)
+
+    def run_opencv(self, fn, frames, workers, like: torch.Tensor, progress: bool = True) -> torch.Tensor:
+        output = np.empty(like.shape, dtype=np.uint8)
+        self.run_parallel(fn, frames, output, workers, progress)
+        return torch.from_numpy(output.astype(np.float32) / 255.0).to(like.device)
+
+    @staticmethod
+    def guided_backend(backend: str, subsample: int) -> str:
+        # opencv-python installed next to opencv-contrib-python can expose ximgproc without guidedFilter
+        has_guided = hasattr(getattr(cv2, "ximgproc", None), "guidedFilter")
+        if backend == "auto":
+            return "opencv" if has_guided and subsample <= 1 else "torch"
+        if backend == "opencv" and not has_guided:
+            print("\033[93m[Shibiko AI] \033[31mcv2.ximgproc.guidedFilter is not available "
+                  "(install opencv-contrib-python), using the torch guided filter\033[0m")
+            return "torch"
+        if backend == "opencv" and subsample > 1:
+            print("\033[93m[Shibiko AI] \033[31mThe opencv guided filter does not subsample, "
+                  "using the torch guided filter for guided_subsample > 1\033[0m")
+            return "torch"
+        return backend
+
+    @staticmethod
+    def run_parallel(fn, frames, output, workers=0, progress=True):
+        """Run ``fn`` on every frame across a thread pool, writing results in order into ``output``.
+
+        OpenCV's filters release the GIL, so frames run truly in parallel. OpenCV's own thread count is scaled down
+        for the duration so the pool and OpenCV together use about one thread per core instead of oversubscribing.
+        """
+        total = len(frames)
+        cores = os.cpu_count() or 1
+        workers = max(1, min(workers or cores, total))
+        pbar = ProgressBar(total) if progress else None
+
+        if workers == 1:
+            for idx, frame in enumerate(frames):
+                if pbar:
+                    pbar.update_absolute(idx, total, f"Removing noise from image {idx + 1}/{total}")
+                output[idx] = fn(frame)
+            if pbar:
+                pbar.update_absolute(total, total, "Complete")
+            return output
+
+        cv2_threads = cv2.getNumThreads()
+        cv2.setNumThreads(max(1, cores // workers))
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="remove_noise") as pool:
+                futures = {pool.submit(fn, frame): idx for idx, frame in enumerate(frames)}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    output[futures[future]] = future.result()
+                    if pbar:
+                        pbar.update_absolute(done, total, f"Removed noise from {done}/{total} images")
+        finally:
+            cv2.setNumThreads(cv2_threads)
+
+        return output
 
 
 NODE_CLASS_MAPPINGS = {"RemoveNoise": RemoveNoise}
@@ -1,6 +1,13 @@
+import os
+
+import folder_paths
 import torch
+import torch.nn.functional as F
 from typing import Optional
-from ..utils.convert import convert, tensor2pil, pil2tensor
+from ..utils.convert import pil2tensor
+from comfy.utils import ProgressBar
+from ..utils.tiles import allocate_output, budget_overlap, budget_tile_size, feather_weights, tile_spans
+from ..utils.waifu2x import cpu_supports_bf16, get_waifu2x, infer, intra_op_threads, waifu2x_device
 
 
 class Waifu2x:
@@ -14,6 +21,25 @@ class Waifu2x:
                 "noise_level": ("INT", {"default": 3, "min": 0, "max": 3, "step": 1},),
                 "scale": ([1, 2, 4],),
                 "model_type": (["art", "photo"],),
+                # auto picks CUDA when it is available and the CPU otherwise
+                "device": (["auto", "cuda", "cpu"], {"default": "auto"}),
+                # Each model type, mode, noise level and device combination is one cached model holding its weights on
+                # that device. Past this many the oldest is dropped, and on CUDA its memory is returned to the driver
+                "max_models": ("INT", {"default": 4, "min": 1, "max": 16, "step": 1}),
+                # Tiles are cut this size and run batch_size at a time through the model
+                "tile_size": ("INT", {"default": 256, "min": 64, "max": 2048, "step": 16}),
+                "batch_size": ("INT", {"default": 4, "min": 1, "max": 64, "step": 1}),
+                # Device memory, in MB, one region of the frame may use. Larger frames are upscaled region by region
+                # with feathered seams, 0 upscales whole frames
+                "memory_budget": ("INT", {"default": 1024, "min": 0, "max": 65536, "step": 64}),
+                # Back the output with a file in ComfyUI's temp directory so it can be larger than RAM
+                "output_mmap": ("BOOLEAN", {"default": False},),
+                # CPU only: channels_last weights, bfloat16 autocast where the CPU has native bf16, torch.compile
+                # (slow first run, cached with the model) and the intra-op thread count, 0 keeps torch's default
+                "cpu_channels_last": ("BOOLEAN", {"default": True},),
+                "cpu_bf16": ("BOOLEAN", {"default": False},),
+                "cpu_compile": ("BOOLEAN", {"default": False},),
+                "cpu_threads": ("INT", {"default": 0, "min": 0, "max": 256, "step": 1}),
             },
         }
 
@@ -27,6 +53,7 @@ class Waifu2x:
     def __init__(self, **kwargs):
         self.amp = kwargs.get('amp', False)
         self.batch_size = kwargs.get('batch_size', 1)
+        self.device = kwargs.get('device', 'auto')
         self.keep_alpha = kwargs.get('keep_alpha', True)
         self.method = 'noise'
         self.model = None
@@ -35,25 +62,41 @@ class Waifu2x:
         self.output_type = kwargs.get('output_type', 'pil')
         self.scale = kwargs.get('scale', 1)
         self.tile_size = kwargs.get('tile_size', 256)
-        self.load()
-
-    def load(self, model_type: Optional[str] = 'art'):
-        self.model = torch.hub.load(
-            'nagadomi/nunif:dev',
-            'waifu2x',
-            model_type=model_type,
+        self.max_models = kwargs.get('max_models', None)
+        self.memory_budget = kwargs.get('memory_budget', 1024)
+        self.output_mmap = kwargs.get('output_mmap', False)
+        self.cpu_channels_last = kwargs.get('cpu_channels_last', True)
+        self.cpu_bf16 = kwargs.get('cpu_bf16', False)
+        self.cpu_compile = kwargs.get('cpu_compile', False)
+        self.cpu_threads = kwargs.get('cpu_threads', 0)
+
+    def load(self, model_type: Optional[str] = None):
+        """Point ``self.model`` at the shared model for the current settings, loading it on first use"""
+        if model_type is not None:
+            self.model_type = model_type
+        self.method = self.waifu2x_method(self.scale, self.noise_level)
+        cpu = waifu2x_device(self.device) == 'cpu'
+        self.model = get_waifu2x(
+            model_type=self.model_type,
+            method=self.method,
+            noise_level=self.noise_level,
+            amp=self.amp,
+            device=waifu2x_device(self.device),
             batch_size=self.batch_size,
             keep_alpha=self.keep_alpha,
-            amp=self.amp,
-            trust_repo=True,
-        ).to('cuda')
-        self.method = self.waifu2x_method(self.scale, self.noise_level)
-        self.model.set_mode(method=self.method, noise_level=self.noise_level)
+            tile_size=self.tile_size,
+            channels_last=cpu and self.cpu_channels_last,
+            compiled=cpu and self.cpu_compile,
+            bf16=cpu and self.cpu_bf16,
+            max_models=self.max_models,
+        )
+        return self.model
 
     def set(
         self,
         amp: Optional[bool] = None,
         batch_size: Optional[int] = None,
+        device: Optional[str] = None,
         enabled: Optional[bool] = None,
         keep_alpha: Optional[bool] = None,
         model_type: Optional[str] = None,
@@ -89,48 +132,87 @@ class Waifu2x:
         scale: Optional[int] = 1,
         noise_level: Optional[int] = 3,
         model_type: Optional[str] = 'art',
+        device: Optional[str] = None,
+        max_models: Optional[int] = None,
+        tile_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        memory_budget: Optional[int] = None,
+        output_mmap: Optional[bool] = None,
+        cpu_channels_last: Optional[bool] = None,
+        cpu_bf16: Optional[bool] = None,
+        cpu_compile: Optional[bool] = None,
+        cpu_threads: Optional[int] = None,
         **kwargs
     ):
-        print('WAIFU2X CALL:', scale, noise_level, model_type)
-        if self.model_type != model_type:
-            self.load(model_type)
-
-        if isinstance(image, torch.Tensor):
-            if image.dim() == 3:
-                image = [image]
-            elif image.dim() == 4:
-                image = [img for img in image]
-
-        tensors = []
-        for img in image:
-            img = img.cpu()
-            img_pil = tensor2pil(img)
-
-            scale = scale if scale is not None else self.scale
-            noise_level = noise_level if noise_level is not None else self.noise_level
-
-            if self.scale != scale or self.noise_level != noise_level:
-                self.method = self.waifu2x_method(scale, noise_level)
-                self.model.set_mode(self.method, noise_level)
-
-            print('METHOD:', self.method)
-
-            img_pil = self.model.infer(img_pil, method=self.method, noise_level=noise_level, output_type='pil')
-
-            img_tensor = pil2tensor(img_pil)
-            tensors.append(img_tensor)
-
-        if len(tensors) > 1:
-            output = torch.cat(tensors, dim=0)
+        self.scale = scale if scale is not None else self.scale
+        self.noise_level = noise_level if noise_level is not None else self.noise_level
+        self.device = device or self.device
+        self.max_models = max_models or self.max_models
+        self.tile_size = tile_size or self.tile_size
+        self.batch_size = batch_size or self.batch_size
+        self.memory_budget = memory_budget if memory_budget is not None else self.memory_budget
+        self.output_mmap = output_mmap if output_mmap is not None else self.output_mmap
+        self.cpu_channels_last = cpu_channels_last if cpu_channels_last is not None else self.cpu_channels_last
+        self.cpu_bf16 = cpu_bf16 if cpu_bf16 is not None else self.cpu_bf16
+        self.cpu_compile = cpu_compile if cpu_compile is not None else self.cpu_compile
+        self.cpu_threads = cpu_threads if cpu_threads is not None else self.cpu_threads
+        # Switching model type or mode is a registry lookup, only the first use of a combination loads it
+        self.load(model_type)
+
+        if not isinstance(image, torch.Tensor):
+            image = torch.cat([pil2tensor(img) for img in image], dim=0)
+        if image.dim() == 3:
+            image = image.unsqueeze(0)
+
+        threads = self.cpu_threads if waifu2x_device(self.device) == 'cpu' else 0
+        with intra_op_threads(threads):
+            return (self.upscale(image),)
+
+    def upscale(self, image: torch.Tensor) -> torch.Tensor:
+        """Upscale a BHWC batch region by region into one preallocated output, without leaving float tensors.
+
+        Regions are sized so their input, output and blended copy fit ``memory_budget`` MB and overlap their
+        neighbours. Each one goes through the model's tiled inference as a CHW tensor on the model's device and is
+        added to the output with feather weights that sum to one, so seams blend away and the device never holds
+        more than one region. An alpha channel is resized alongside.
+        """
+        device = waifu2x_device(self.device)
+        bf16 = self.cpu_bf16 and device == 'cpu' and cpu_supports_bf16()
+        total, height, width, channels = image.shape
+        if self.memory_budget > 0:
+            tile = budget_tile_size(self.memory_budget * 2 ** 20, max(self.scale, 1))
+            overlap = budget_overlap(tile)
         else:
-            output = tensors[0]
-
-        if output.dtype != torch.float32:
-            output = output.float()
-        if output.max() > 1.0:
-            output = output / 255.0
-
-        return (output,)
+            tile, overlap = max(height, width), 0
+        rows, cols = tile_spans(height, tile, overlap), tile_spans(width, tile, overlap)
+
+        progress = ProgressBar(total)
+        output = row_weights = col_weights = None
+        scale = 1
+        for idx, frame in enumerate(image):
+            for r, (y0, y1) in enumerate(rows):
+                for c, (x0, x1) in enumerate(cols):
+                    x = frame[y0:y1, x0:x1, :3].permute(2, 0, 1).to(device, torch.float32)
+                    z = infer(self.model, x, self.method, self.noise_level, bf16).clamp(0, 1).permute(1, 2, 0)
+
+                    if output is None:
+                        scale = z.shape[0] // (y1 - y0)
+                        mmap_dir = folder_paths.get_temp_directory() if self.output_mmap else None
+                        if mmap_dir is not None:
+                            os.makedirs(mmap_dir, exist_ok=True)
+                        output = allocate_output((total, height * scale, width * scale, channels), mmap_dir)
+                        row_weights = feather_weights(rows, height, overlap * scale, scale)
+                        col_weights = feather_weights(cols, width, overlap * scale, scale)
+
+                    weight = (row_weights[r].to(z.device)[:, None] * col_weights[c].to(z.device)[None, :])[..., None]
+                    output[idx, y0 * scale:y1 * scale, x0 * scale:x1 * scale, :3] += (z * weight).cpu()
+
+            if channels == 4:
+                alpha = frame[..., 3].to(torch.float32)[None, None]
+                output[idx, ..., 3] = F.interpolate(alpha, size=(height * scale, width * scale), mode='bicubic',
+                                                    align_corners=False)[0, 0].clamp(0, 1)
+            progress.update_absolute(idx + 1, total)
+        return output
 
 
 NODE_CLASS_MAPPINGS = {"Waifu2x": Waifu2x}
@@ -0,0 +1,83 @@
+"""Install a pinned copy of nunif's waifu2x code and weights into models/waifu2x for offline loading.
+
+Resolves --ref to a commit, downloads that commit's source, loads every model type once so nunif fetches its
+weights into the install, then writes waifu2x.lock.json with the commit and the sha256 of every file.
+
+Usage: python scripts/install_waifu2x.py [--ref dev] [--home ComfyUI/models/waifu2x]
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import urllib.request
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from utils.directory import initialize_directory  # noqa: E402
+from utils.waifu2x import CODE_DIR, HUB_DIR, LOCK_FILE, hash_tree, hub_load  # noqa: E402
+
+REPO = 'nagadomi/nunif'
+METHODS = [('noise', 3), ('scale', -1), ('noise_scale', 3), ('scale4x', -1), ('noise_scale4x', 3)]
+
+
+def fetch(url):
+    request = urllib.request.Request(url, headers={'User-Agent': 'shibiko-ai-waifu2x-install'})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def resolve_commit(ref):
+    return json.loads(fetch(f'https://api.github.com/repos/{REPO}/commits/{ref}'))['sha']
+
+
+def install_code(commit, code):
+    archive = zipfile.ZipFile(io.BytesIO(fetch(f'https://codeload.github.com/{REPO}/zip/{commit}')))
+    with tempfile.TemporaryDirectory() as tmp:
+        archive.extractall(tmp)
+        (top,) = os.listdir(tmp)
+        if os.path.isdir(code):
+            shutil.rmtree(code)
+        shutil.move(os.path.join(tmp, top), code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ref', default='dev', help='nunif branch, tag or commit to pin')
+    parser.add_argument('--home', default=None, help='install directory, models/waifu2x by default')
+    args = parser.parse_args()
+
+    home = os.path.abspath(args.home or initialize_directory('waifu2x'))
+    os.makedirs(home, exist_ok=True)
+    code = os.path.join(home, CODE_DIR)
+    lock_path = os.path.join(home, LOCK_FILE)
+    # An install without its lock file is never loaded, so a failure below leaves the node on torch.hub
+    if os.path.exists(lock_path):
+        os.remove(lock_path)
+
+    commit = resolve_commit(args.ref)
+    print(f'Installing {REPO}@{commit} into {home}')
+    install_code(commit, code)
+
+    os.makedirs(os.path.join(home, HUB_DIR), exist_ok=True)
+    for model_type in ('art', 'photo'):
+        for method, noise_level in METHODS:
+            try:
+                hub_load(code, model_type=model_type, method=method, noise_level=noise_level)
+            except Exception as e:
+                print(f'  {model_type} {method}: not available ({e})')
+            else:
+                print(f'  {model_type} {method}: ok')
+
+    files = hash_tree(home)
+    with open(lock_path, 'w') as f:
+        json.dump({'repo': REPO, 'ref': args.ref, 'commit': commit, 'files': files}, f, indent=2, sort_keys=True)
+    print(f'Wrote {lock_path} with {len(files)} files')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+
+from typing import Callable, Dict, List, Optional
+from .cube import read_cube_header
+
+
+class Asset:
+    """One indexed asset file and the metadata recorded for it."""
+
+    def __init__(self, name: str, path: str, size: int, mtime: int, metadata: Optional[Dict] = None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.metadata = metadata or {}
+
+    def __repr__(self):
+        return f'Asset({self.name!r}, {self.path!r})'
+
+
+class AssetIndex:
+    """In-memory index of the asset files with one extension across several directories.
+
+    Directories are scanned once, without descending into subdirectories. After that a refresh only stats the
+    directories and the files already indexed. A directory whose mtime changed, or whose files were rewritten in place
+    (which leaves the directory's mtime alone), is rescanned with only its new or modified files described again.
+    ``refresh(force=True)`` rescans everything. Dropdown lists and name-to-path lookups are answered from memory.
+    When a name exists in more than one directory, the first directory wins.
+
+    ``prefixes`` maps a directory to a filename prefix that is left off the names of its assets.
+    """
+
+    def __init__(self, directories: List[str], extension: str, describe: Optional[Callable[[str], Dict]] = None,
+                 prefixes: Optional[Dict[str, str]] = None):
+        self.directories = []
+        for directory in directories:
+            if directory and os.path.realpath(directory) not in map(os.path.realpath, self.directories):
+                self.directories.append(directory)
+        self.extension = extension
+        self.describe = describe
+        self.prefixes = prefixes or {}
+        self._directory_mtimes = {}
+        self._directory_assets = {}
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            changed = False
+            for directory in self.directories:
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if not force and self._directory_mtimes.get(directory, -1) == mtime and not self._modified(directory):
+                    continue
+                self._directory_mtimes[directory] = mtime
+                self._directory_assets[directory] = self._scan(directory, self._directory_assets.get(directory, {}))
+                changed = True
+
+            if changed:
+                assets = {}
+                for directory in reversed(self.directories):
+                    assets.update(self._directory_assets[directory])
+                self._assets = assets
+
+    def _modified(self, directory: str) -> bool:
+        """Whether a file indexed in ``directory`` was rewritten or removed since it was scanned"""
+        for asset in self._directory_assets.get(directory, {}).values():
+            try:
+                stat = os.stat(asset.path)
+            except OSError:
+                return True
+            if stat.st_size != asset.size or stat.st_mtime_ns != asset.mtime:
+                return True
+        return False
+
+    def _scan(self, directory: str, previous: Dict[str, Asset]) -> Dict[str, Asset]:
+        assets = {}
+        if not os.path.isdir(directory):
+            return assets
+
+        for entry in os.scandir(directory):
+            if not entry.name.endswith(self.extension) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            name = self.name_for(entry.name, directory)
+            asset = previous.get(name)
+            if asset is None or asset.path != entry.path or asset.size != stat.st_size or asset.mtime != stat.st_mtime_ns:
+                asset = Asset(name, entry.path, stat.st_size, stat.st_mtime_ns, self._describe(entry.path))
+            assets[name] = asset
+        return assets
+
+    def _describe(self, path: str) -> Dict:
+        if self.describe is None:
+            return {}
+        try:
+            return self.describe(path)
+        except (OSError, ValueError) as e:
+            return {'error': str(e)}
+
+    def name_for(self, filename: str, directory: Optional[str] = None) -> str:
+        name = filename[:-len(self.extension)]
+        prefix = self.prefixes.get(directory, '')
+        if prefix and name.startswith(prefix):
+            name = name[len(prefix):]
+        return name
+
+    def assets(self) -> List[Asset]:
+        self.refresh()
+        return [self._assets[name] for name in sorted(self._assets)]
+
+    def names(self, extension: bool = False) -> List[str]:
+        self.refresh()
+        return sorted(name + self.extension if extension else name for name in self._assets)
+
+    def get(self, name: str) -> Optional[Asset]:
+        """Look an asset up by name, with or without its extension"""
+        if name.endswith(self.extension):
+            name = name[:-len(self.extension)]
+        self.refresh()
+        return self._assets.get(name)
+
+    def path(self, name: str) -> Optional[str]:
+        asset = self.get(name)
+        return asset.path if asset else None
+
+
+def describe_lut(path: str) -> Dict:
+    header = read_cube_header(path)
+    return {
+        'title': header.title,
+        'size': header.size,
+        'dimensions': header.dimensions,
+        'domain': header.domain.tolist(),
+    }
+
+
+def describe_cascade(path: str) -> Dict:
+    with open(path, errors='ignore') as f:
+        head = f.read(4096)
+
+    match = re.search(r'<featureType>\s*(\w+)\s*</featureType>', head)
+    if match:
+        cascade_type = match.group(1).upper()
+    elif 'opencv-haar-classifier' in head:
+        cascade_type = 'HAAR'
+    else:
+        cascade_type = 'UNKNOWN'
+    return {'type': cascade_type}
@@ -0,0 +1,96 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+# Pixels sliced per chunk, slicing builds a sampling grid three times the size of the output
+CHUNK_PIXELS = 1 << 22
+
+# Binomial blur of the grid, close to a Gaussian with a standard deviation of one cell
+GRID_KERNEL = (1.0, 4.0, 6.0, 4.0, 1.0)
+GRID_PADDING = 2
+
+# Splatting to the nearest cell and slicing trilinearly widen the grid's footprint by about this much
+GRID_SPREAD = 1.1
+
+
+def opencv_sigmas(diameter: int, sigma_color: float, sigma_space: float):
+    """Grid sigmas that approximate cv2.bilateralFilter(src, diameter, sigma_color, sigma_space) on a colour image.
+
+    OpenCV cuts its spatial Gaussian off at a disc of radius diameter / 2, so the spatial sigma is the per-axis
+    spread of that truncated disc. OpenCV's colour distance is the sum of the three channel differences, the grid
+    filters each channel on its own range, and half the colour sigma matched it best on photos and on noise.
+    Returns ``(sigma_space, sigma_color)`` in pixels and in [0, 1] units.
+    """
+    radius = diameter // 2 if diameter > 0 else round(sigma_space * 1.5)
+    sigma_space = max(sigma_space, 1e-6)
+    # Weights past 4 sigma are below exp(-8) and do not move the spread, so large diameters stay cheap
+    reach = min(radius, math.ceil(4 * sigma_space))
+    offsets = torch.arange(-reach, reach + 1, dtype=torch.float64)
+    gauss = torch.exp(-0.5 * offsets * offsets / sigma_space ** 2)
+    # The Gaussian is separable, so each column of the disc weighs gauss(x) times the sum of gauss(y) over |y| below
+    # the disc's half height there, read from a cumulative sum
+    cumulative = torch.cat([torch.zeros(1, dtype=torch.float64), gauss.cumsum(0)])
+    half = torch.sqrt((radius * radius - offsets * offsets).clamp_min(0)).floor().clamp(max=reach).long()
+    columns = gauss * (cumulative[reach + half + 1] - cumulative[reach - half])
+    spread = math.sqrt(float((columns * offsets * offsets).sum() / columns.sum()))
+    return spread / GRID_SPREAD, sigma_color / 255.0 / 2
+
+
+def bilateral_grid(image: torch.Tensor, sigma_space: float, sigma_color: float, passes: int = 1) -> torch.Tensor:
+    """Approximate bilateral filter of a BHWC batch on a bilateral grid (Chen, Paris and Durand 2007).
+
+    Every channel is splatted into a coarse (value, y, x) grid with one cell per sigma, the grid is blurred, and
+    every pixel reads its result back with a trilinear lookup. The cost depends on the image size and the number
+    of value cells, not on ``sigma_space``. ``sigma_color`` is in [0, 1] units.
+    """
+    output = torch.empty(image.shape, dtype=torch.float32, device=image.device)
+    frames_per_chunk = max(1, CHUNK_PIXELS // max(1, image[0].numel()))
+    for start in range(0, image.shape[0], frames_per_chunk):
+        chunk = image[start:start + frames_per_chunk].permute(0, 3, 1, 2).float()
+        batch, channels, height, width = chunk.shape
+        # Channels are independent grids, fold them into the batch
+        chunk = chunk.reshape(batch * channels, height, width)
+        for _ in range(passes):
+            chunk = _grid_pass(chunk, sigma_space, sigma_color)
+        output[start:start + frames_per_chunk] = chunk.view(batch, channels, height, width).permute(0, 2, 3, 1)
+    return output
+
+
+def _grid_pass(x: torch.Tensor, sigma_space: float, sigma_color: float) -> torch.Tensor:
+    batch, height, width = x.shape
+    sigma_space = max(sigma_space, 1.0)
+    sigma_color = max(sigma_color, 1e-3)
+
+    # Grid coordinates of every pixel, in cells, offset by the blur padding
+    gz = (x - x.amin(dim=(1, 2), keepdim=True)) / sigma_color + GRID_PADDING
+    gy = torch.arange(height, device=x.device, dtype=x.dtype) / sigma_space + GRID_PADDING
+    gx = torch.arange(width, device=x.device, dtype=x.dtype) / sigma_space + GRID_PADDING
+    depth = int(gz.amax().ceil().item()) + GRID_PADDING + 1
+    rows = int(math.ceil((height - 1) / sigma_space)) + 2 * GRID_PADDING + 1
+    cols = int(math.ceil((width - 1) / sigma_space)) + 2 * GRID_PADDING + 1
+
+    # Splat homogeneous (value, 1) pairs to the nearest cell
+    index = (gz.round().long() * rows + gy.round().long().view(1, height, 1)) * cols \
+        + gx.round().long().view(1, 1, width)
+    values = torch.stack([x, torch.ones_like(x)], dim=1).flatten(2)
+    grid = torch.zeros(batch, 2, depth * rows * cols, device=x.device, dtype=x.dtype)
+    grid.scatter_add_(2, index.flatten(1).unsqueeze(1).expand(-1, 2, -1), values)
+    grid = grid.view(batch, 2, depth, rows, cols)
+
+    # Separable blur along value, y and x
+    kernel = torch.tensor(GRID_KERNEL, device=x.device, dtype=x.dtype)
+    kernel = kernel / kernel.sum()
+    for shape in ((-1, 1, 1), (1, -1, 1), (1, 1, -1)):
+        weight = kernel.view(shape).expand(2, 1, *kernel.view(shape).shape)
+        padding = tuple(size // 2 for size in weight.shape[2:])
+        grid = F.conv3d(grid, weight, padding=padding, groups=2)
+
+    # Slice: trilinear lookup at each pixel's exact grid position, align_corners maps -1..1 to cell centres
+    sample = torch.stack([
+        gx.view(1, 1, width).expand(batch, height, width) / (cols - 1),
+        gy.view(1, height, 1).expand(batch, height, width) / (rows - 1),
+        gz / (depth - 1),
+    ], dim=-1) * 2 - 1
+    sliced = F.grid_sample(grid, sample.unsqueeze(1), mode="bilinear", align_corners=True).squeeze(2)
+    return sliced[:, 0] / sliced[:, 1].clamp_min(1e-8)
@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe, process-wide least-recently-used cache.
+
+    Values are created on demand through ``get(key, factory)`` and the least recently used entry is
+    evicted once ``maxsize`` entries are resident. ``on_evict`` is called with ``(key, value)`` for every
+    entry that leaves the cache, whether through eviction, ``pop`` or ``clear``.
+    """
+
+    def __init__(self, maxsize=16, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def get(self, key, factory=None):
+        """The value cached for ``key``, built with ``factory()`` and inserted when it is missing.
+
+        The factory runs outside the lock, so a slow load does not block lookups of other keys. When two threads build
+        the same key at once, the value inserted first is kept and returned to both, and the other one is handed to
+        ``on_evict``.
+        """
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+
+            self.misses += 1
+            if factory is None:
+                return None
+
+        value = factory()
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = value
+                self._evict()
+                return value
+            self._items.move_to_end(key)
+            existing = self._items[key]
+        if self.on_evict:
+            self.on_evict(key, value)
+        return existing
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self._evict()
+
+    def pop(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+        if value is not None and self.on_evict:
+            self.on_evict(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            items = list(self._items.items())
+            self._items.clear()
+        if self.on_evict:
+            for key, value in items:
+                self.on_evict(key, value)
+
+    def keys(self):
+        with self._lock:
+            return list(self._items.keys())
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._items), "maxsize": self.maxsize}
+
+    def _evict(self):
+        while self.maxsize is not None and len(self._items) > max(self.maxsize, 0):
+            key, value = self._items.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(key, value)
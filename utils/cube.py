@@ -0,0 +1,159 @@
+import glob
+import io
+import os
+import re
+
+import numpy as np
+from typing import Optional, Union
+
+SIDECAR_SUFFIX = '.npy'
+DEFAULT_DOMAIN = np.array([[0., 0., 0.], [1., 1., 1.]], dtype=np.float32)
+
+
+class CubeHeader:
+    """Keywords of an Iridas/Resolve `.cube` file, plus where its numeric body starts."""
+
+    def __init__(self, title: Optional[str] = None, size: Optional[int] = None, dimensions: int = 3,
+                 domain: Optional[np.ndarray] = None, data_offset: int = 0):
+        self.title = title
+        self.size = size
+        self.dimensions = dimensions
+        self.domain = DEFAULT_DOMAIN.copy() if domain is None else domain
+        self.data_offset = data_offset
+
+    @property
+    def shape(self):
+        if self.dimensions == 1:
+            return self.size, 3
+        return self.size, self.size, self.size, 3
+
+
+def parse_cube_header(text: str, path: Union[str, os.PathLike] = '') -> CubeHeader:
+    """Parse the keyword lines that precede the first row of table data"""
+    header = CubeHeader()
+    offset = 0
+    for line in io.StringIO(text):
+        stripped = line.strip()
+        if stripped and (stripped[0].isdigit() or stripped[0] in '+-.'):
+            break
+        offset += len(line)
+        if not stripped or stripped.startswith('#'):
+            continue
+
+        # Keywords may be followed by spaces or tabs
+        keyword, value = (stripped.split(None, 1) + [''])[:2]
+        value = value.strip()
+        if keyword == 'TITLE':
+            header.title = value.strip('"')
+        elif keyword in ('LUT_3D_SIZE', 'LUT_1D_SIZE'):
+            if header.size is not None:
+                raise ValueError(f'{path}: both LUT_1D_SIZE and LUT_3D_SIZE are set')
+            header.size = int(value)
+            header.dimensions = 3 if keyword == 'LUT_3D_SIZE' else 1
+        elif keyword == 'DOMAIN_MIN':
+            header.domain[0] = [float(v) for v in value.split()]
+        elif keyword == 'DOMAIN_MAX':
+            header.domain[1] = [float(v) for v in value.split()]
+        elif keyword in ('LUT_1D_INPUT_RANGE', 'LUT_3D_INPUT_RANGE'):
+            low, high = (float(v) for v in value.split())
+            header.domain[0] = low
+            header.domain[1] = high
+
+    header.data_offset = offset
+    return header
+
+
+def read_cube_header(path: Union[str, os.PathLike]) -> CubeHeader:
+    """Read only the header of a `.cube` file, without touching its table"""
+    with open(path) as f:
+        lines = []
+        for line in f:
+            stripped = line.strip()
+            if stripped and (stripped[0].isdigit() or stripped[0] in '+-.'):
+                break
+            lines.append(line)
+    return parse_cube_header(''.join(lines), path)
+
+
+def read_cube(path: Union[str, os.PathLike]):
+    """Read a `.cube` file into its header and a contiguous float32 table.
+
+    3D tables are shaped (size, size, size, 3) and indexed [b, g, r] (the order the rows appear in the file, red
+    changing fastest), 1D tables are shaped (size, 3). The row count must agree with LUT_3D_SIZE/LUT_1D_SIZE.
+    """
+    with open(path) as f:
+        text = f.read()
+
+    header = parse_cube_header(text, path)
+    table = np.loadtxt(io.StringIO(text[header.data_offset:]), dtype=np.float32, comments='#', ndmin=2)
+    if table.shape[1] != 3:
+        raise ValueError(f'{path}: expected 3 values per row, got {table.shape[1]}')
+
+    if header.size is None:
+        # No size keyword, only accept a row count that is an exact cube
+        size = round(len(table) ** (1 / 3))
+        if size ** 3 != len(table):
+            raise ValueError(f'{path}: missing LUT_3D_SIZE and {len(table)} rows is not a cube')
+        header.size = size
+
+    expected = header.size ** header.dimensions
+    if len(table) != expected:
+        raise ValueError(f'{path}: LUT_{header.dimensions}D_SIZE {header.size} needs {expected} rows, got {len(table)}')
+
+    return header, np.ascontiguousarray(table.reshape(header.shape))
+
+
+def load_cube(path: Union[str, os.PathLike]):
+    """Read a `.cube` file through its compiled sidecar.
+
+    The parsed table is saved next to the source as `<name>.cube.<size>-<mtime_ns>.npy`, named after the source's
+    size and mtime, and later loads memory-map it read-only so workers on one host share its pages. A source that was
+    rewritten, even with its mtime kept, no longer matches the name and is parsed again.
+    """
+    path = os.fspath(path)
+    source_stat = os.stat(path)
+    sidecar = sidecar_path(path, source_stat)
+
+    try:
+        if os.path.isfile(sidecar):
+            header = read_cube_header(path)
+            table = np.load(sidecar, mmap_mode='r')
+            if header.size is None and table.ndim == 4:
+                header.size = table.shape[0]
+            if table.dtype == np.float32 and table.shape == header.shape:
+                return header, table
+    except (OSError, ValueError):
+        pass
+
+    header, table = read_cube(path)
+    write_sidecar(path, sidecar, table)
+    return header, table
+
+
+def sidecar_path(path: str, source_stat: os.stat_result) -> str:
+    """Compiled table of ``path`` for the source's current size and mtime"""
+    return f'{path}.{source_stat.st_size}-{source_stat.st_mtime_ns}{SIDECAR_SUFFIX}'
+
+
+def write_sidecar(path: str, sidecar: str, table: np.ndarray):
+    """Atomically write a compiled table, then remove the sidecars of earlier versions of ``path``"""
+    temp_path = f'{sidecar}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            np.save(f, table)
+        os.replace(temp_path, sidecar)
+    except OSError as e:
+        # Read-only LUT folders still work, they just parse the text file every time
+        print(f'\033[93m[Shibiko AI] \033[31mCould not write LUT sidecar {sidecar}: {e}\033[0m')
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return
+
+    # Earlier versions' sidecars, and the unstamped `<name>.cube.npy` older releases wrote
+    stale = re.compile(re.escape(path) + r'(\.\d+-\d+)?' + re.escape(SIDECAR_SUFFIX))
+    for old in glob.glob(glob.escape(path) + '*' + SIDECAR_SUFFIX):
+        if old != sidecar and stale.fullmatch(old):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
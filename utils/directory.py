@@ -28,6 +28,8 @@ def initialize_directory(directory_name):
 
     if not (os.path.exists(target_directory) and os.path.isdir(target_directory)):
         os.makedirs(target_directory)
+        if not os.path.isdir(source_directory):
+            return target_directory
         # Copy files from source_directory to target_directory
         for filename in os.listdir(source_directory):
             src_file = os.path.join(source_directory, filename)
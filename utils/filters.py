@@ -0,0 +1,335 @@
+import math
+
+import torch
+import torch.nn.functional as F
+from PIL import ImageFilter
+from .cache import LRUCache
+
+# PIL's built-in kernels, taken from PIL itself so both backends always agree
+PIL_KERNELS = {
+    "blur": ImageFilter.BLUR,
+    "sharpen": ImageFilter.SHARPEN,
+    "smooth": ImageFilter.SMOOTH,
+    "smooth_more": ImageFilter.SMOOTH_MORE,
+    "detail": ImageFilter.DETAIL,
+    "edge_enhance_more": ImageFilter.EDGE_ENHANCE_MORE,
+}
+
+# Compiled blur/sharpen/smooth/smooth_more chains, keyed by their pass counts and device
+FILTER_CHAIN_CACHE = LRUCache(maxsize=64)
+
+# Gaussian blur switches from a direct convolution to a box cascade and then to an FFT above these sigmas
+GAUSSIAN_MODES = ["auto", "direct", "box", "fft"]
+GAUSSIAN_DIRECT_SIGMA = 4.0
+GAUSSIAN_BOX_SIGMA = 64.0
+
+# ITU-R 601-2 luma, what PIL uses for convert("L")
+LUMA = (0.299, 0.587, 0.114)
+
+
+def pil_kernel(name: str, device=None) -> torch.Tensor:
+    """A PIL built-in filter kernel, divided by its scale"""
+    (width, height), scale, offset, kernel = PIL_KERNELS[name].filterargs
+    return torch.tensor(kernel, dtype=torch.float32, device=device).reshape(height, width) / scale
+
+
+def kernel_filter(x: torch.Tensor, kernel: torch.Tensor, passes: int = 1) -> torch.Tensor:
+    """Apply a kernel ``passes`` times to every channel of a BCHW tensor the way PIL's Image.filter does.
+
+    Like PIL, each pass is clipped to [0, 1] and the border the kernel cannot cover is left untouched.
+    """
+    pad_y, pad_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+    if passes <= 0 or x.shape[-2] <= 2 * pad_y or x.shape[-1] <= 2 * pad_x:
+        return x
+
+    channels = x.shape[1]
+    weight = kernel.to(device=x.device, dtype=x.dtype).expand(channels, 1, *kernel.shape)
+    out = x.clone()
+    for _ in range(passes):
+        filtered = F.conv2d(out, weight, groups=channels).clamp_(0, 1)
+        out[..., pad_y:out.shape[-2] - pad_y, pad_x:out.shape[-1] - pad_x] = filtered
+    return out
+
+
+def compose_kernels(first: torch.Tensor, second: torch.Tensor) -> torch.Tensor:
+    """The single kernel equivalent to filtering with ``first`` and then with ``second``"""
+    pad_y, pad_x = second.shape[0] - 1, second.shape[1] - 1
+    padded = F.pad(first[None, None], (pad_x, pad_x, pad_y, pad_y))
+    return F.conv2d(padded, second.flip(0, 1)[None, None])[0, 0]
+
+
+class CompiledKernel:
+    """A linear filter chain folded into one kernel, run whichever way is cheapest for its size.
+
+    Small kernels are convolved directly. Medium ones that factor into a few separable terms (SVD, truncated once the
+    dropped singular values fall below ``tolerance`` of the total) run as 1D passes, and large ones go through an
+    FFT, whose cost does not depend on the kernel size. Like PIL, the border the kernel cannot cover is copied from
+    the input unfiltered, and the result is clipped once at the end.
+    """
+    direct_size = 7
+    separable_size = 15
+
+    def __init__(self, kernel: torch.Tensor, tolerance: float = 1e-5):
+        self.kernel = kernel
+        self.pad_y, self.pad_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+        self.mode = "direct" if max(kernel.shape) <= self.direct_size else "fft"
+        self.separable = []
+
+        if self.mode == "fft" and max(kernel.shape) <= self.separable_size:
+            u, singular, v = torch.linalg.svd(kernel.double())
+            remaining = singular.flip(0).cumsum(0).flip(0) / singular.sum()
+            rank = max(1, int((remaining > tolerance).sum()))
+            if rank * (kernel.shape[0] + kernel.shape[1]) < kernel.numel():
+                self.mode = "separable"
+                scale = singular[:rank].sqrt()
+                self.separable = [((u[:, i] * scale[i]).float(), (v[i] * scale[i]).float()) for i in range(rank)]
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if x.shape[-2] <= 2 * self.pad_y or x.shape[-1] <= 2 * self.pad_x:
+            return x
+
+        channels = x.shape[1]
+        kernel = self.kernel.to(device=x.device, dtype=x.dtype)
+
+        if self.mode == "direct":
+            out = F.conv2d(x, kernel.expand(channels, 1, *kernel.shape), groups=channels)
+        elif self.mode == "separable":
+            out = None
+            for column, row in self.separable:
+                horizontal = row.to(device=x.device, dtype=x.dtype).view(1, 1, 1, -1).expand(channels, 1, 1, -1)
+                vertical = column.to(device=x.device, dtype=x.dtype).view(1, 1, -1, 1).expand(channels, 1, -1, 1)
+                term = F.conv2d(F.conv2d(x, horizontal, groups=channels), vertical, groups=channels)
+                out = term if out is None else out.add_(term)
+        else:
+            out = fft_correlate(x, kernel)
+
+        result = x.clone()
+        result[..., self.pad_y:x.shape[-2] - self.pad_y, self.pad_x:x.shape[-1] - self.pad_x] = out.clamp_(0, 1)
+        return result
+
+
+def fft_correlate(padded: torch.Tensor, kernel: torch.Tensor) -> torch.Tensor:
+    """Valid-mode correlation of a BCHW tensor with a 2D kernel through the FFT"""
+    height, width = padded.shape[-2:]
+    spectrum = torch.fft.rfft2(padded.float()) * torch.fft.rfft2(kernel.float().flip(0, 1), s=(height, width))
+    out = torch.fft.irfft2(spectrum, s=(height, width))
+    return out[..., kernel.shape[0] - 1:, kernel.shape[1] - 1:].to(padded.dtype)
+
+
+def compile_filter_chain(passes, device=None) -> CompiledKernel:
+    """Fold ``(kernel name, pass count)`` pairs, applied in order, into one cached CompiledKernel"""
+    passes = tuple((name, count) for name, count in passes if count > 0)
+
+    def build():
+        kernel = torch.ones(1, 1, dtype=torch.float64, device=device)
+        for name, count in passes:
+            step = pil_kernel(name, device).double()
+            for _ in range(count):
+                kernel = compose_kernels(kernel, step)
+        return CompiledKernel(kernel.float())
+
+    return FILTER_CHAIN_CACHE.get((passes, str(device)), build)
+
+
+def filter_chain(x: torch.Tensor, passes) -> torch.Tensor:
+    """Run ``(kernel name, pass count)`` pairs in order, one pass at a time, exactly like PIL"""
+    for name, count in passes:
+        if count > 0:
+            x = kernel_filter(x, pil_kernel(name, x.device), count)
+    return x
+
+
+def split_chain(passes):
+    """Split ``(kernel name, pass count)`` pairs into runs that can be fused and runs that cannot.
+
+    A kernel without negative weights keeps [0, 1] input inside [0, 1], so PIL's clipping between its passes never
+    changes anything and folding a run of them into one kernel is exact. Sharpen overshoots, and skipping its
+    clipping would visibly change the result, so it always runs pass by pass. Returns ``(fusable, run)`` pairs.
+    """
+    runs = []
+    for name, count in passes:
+        if count <= 0:
+            continue
+        fusable = bool((pil_kernel(name) >= 0).all())
+        if runs and runs[-1][0] and fusable:
+            runs[-1][1].append((name, count))
+        else:
+            runs.append((fusable, [(name, count)]))
+    return runs
+
+
+def fused_filter_chain(x: torch.Tensor, passes) -> torch.Tensor:
+    """``filter_chain`` of non-negative kernels through one compiled kernel, with PIL's border semantics.
+
+    PIL copies each pass's border, so pixels within the chain's reach of the edge depend on every pass. Those are
+    recomputed pass by pass on strips twice the reach wide, whose own inner edge cannot reach back into the part that
+    is kept. When those strips would be a large share of the frame that costs more than fusing saves, so the chain
+    runs pass by pass instead.
+    """
+    compiled = compile_filter_chain(passes, x.device)
+    ring_y, ring_x = compiled.pad_y, compiled.pad_x
+    height, width = x.shape[-2:]
+    if 4 * max(ring_y, ring_x) * (height + width) > height * width / 4:
+        return filter_chain(x, passes)
+
+    out = compiled(x)
+    if ring_y > 0:
+        out[..., :ring_y, :] = filter_chain(x[..., :2 * ring_y, :], passes)[..., :ring_y, :]
+        out[..., -ring_y:, :] = filter_chain(x[..., -2 * ring_y:, :], passes)[..., -ring_y:, :]
+    if ring_x > 0:
+        out[..., :, :ring_x] = filter_chain(x[..., :, :2 * ring_x], passes)[..., :, :ring_x]
+        out[..., :, -ring_x:] = filter_chain(x[..., :, -2 * ring_x:], passes)[..., :, -ring_x:]
+    return out
+
+
+def gaussian_kernel_1d(sigma: float, device=None) -> torch.Tensor:
+    radius = max(1, math.ceil(3 * sigma))
+    coords = torch.arange(-radius, radius + 1, dtype=torch.float32, device=device)
+    kernel = torch.exp(-0.5 * (coords / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def gaussian_blur(x: torch.Tensor, sigma: float, mode: str = "auto") -> torch.Tensor:
+    """Gaussian blur of a BCHW tensor with edge replication, PIL's GaussianBlur(radius=sigma).
+
+    ``auto`` picks the algorithm by sigma: a direct separable convolution while the kernel is short, a three-pass
+    box cascade (what PIL itself does, constant cost per pixel) for medium sigma and an FFT for very large sigma.
+    """
+    if sigma <= 0:
+        return x
+
+    if mode == "auto":
+        mode = "direct" if sigma <= GAUSSIAN_DIRECT_SIGMA else "box" if sigma <= GAUSSIAN_BOX_SIGMA else "fft"
+
+    if mode == "box":
+        return gaussian_blur_box(x, sigma)
+    if mode == "fft":
+        return gaussian_blur_fft(x, sigma)
+    return gaussian_blur_direct(x, sigma)
+
+
+def gaussian_blur_direct(x: torch.Tensor, sigma: float) -> torch.Tensor:
+    kernel = gaussian_kernel_1d(sigma, x.device).to(x.dtype)
+    radius = kernel.numel() // 2
+    channels = x.shape[1]
+    horizontal = kernel.view(1, 1, 1, -1).expand(channels, 1, 1, -1)
+    vertical = kernel.view(1, 1, -1, 1).expand(channels, 1, -1, 1)
+    x = F.conv2d(F.pad(x, (radius, radius, 0, 0), mode="replicate"), horizontal, groups=channels)
+    return F.conv2d(F.pad(x, (0, 0, radius, radius), mode="replicate"), vertical, groups=channels)
+
+
+def box_sizes(sigma: float, passes: int = 3):
+    """Odd box widths whose cascade has the variance of a Gaussian with the given sigma"""
+    ideal = math.sqrt(12 * sigma * sigma / passes + 1)
+    lower = math.floor(ideal)
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    count = round((12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    return [lower if i < count else upper for i in range(passes)]
+
+
+def box_blur_1d(x: torch.Tensor, radius: int, dim: int) -> torch.Tensor:
+    """Moving average along one spatial dim through a running sum, so the cost does not depend on the radius"""
+    if radius <= 0:
+        return x
+    pad = (radius + 1, radius, 0, 0) if dim == -1 else (0, 0, radius + 1, radius)
+    summed = F.pad(x, pad, mode="replicate").cumsum(dim)
+    length = x.shape[dim]
+    upper = summed.narrow(dim, 2 * radius + 1, length)
+    lower = summed.narrow(dim, 0, length)
+    return (upper - lower) / (2 * radius + 1)
+
+
+def gaussian_blur_box(x: torch.Tensor, sigma: float) -> torch.Tensor:
+    for width in box_sizes(sigma):
+        x = box_blur_1d(box_blur_1d(x, width // 2, -1), width // 2, -2)
+    return x
+
+
+def gaussian_blur_fft(x: torch.Tensor, sigma: float) -> torch.Tensor:
+    # Replicate the border so the circular convolution does not wrap the opposite edge in
+    height, width = x.shape[-2:]
+    pad_y = min(math.ceil(3 * sigma), height)
+    pad_x = min(math.ceil(3 * sigma), width)
+    padded = F.pad(x.float(), (pad_x, pad_x, pad_y, pad_y), mode="replicate")
+
+    # The transfer function of a Gaussian is a Gaussian, so there is no kernel to transform
+    size_y, size_x = padded.shape[-2:]
+    frequency_y = torch.fft.fftfreq(size_y, device=x.device)
+    frequency_x = torch.fft.rfftfreq(size_x, device=x.device)
+    transfer = torch.exp(-2 * (math.pi * sigma) ** 2 * (frequency_y[:, None] ** 2 + frequency_x[None, :] ** 2))
+
+    out = torch.fft.irfft2(torch.fft.rfft2(padded) * transfer, s=(size_y, size_x))
+    return out[..., pad_y:pad_y + height, pad_x:pad_x + width]
+
+
+def blend(degenerate: torch.Tensor, x: torch.Tensor, factor: float) -> torch.Tensor:
+    """PIL's ImageEnhance blend: factor 0 gives the degenerate image, 1 the original, above 1 extrapolates"""
+    return torch.lerp(degenerate, x, factor).clamp_(0, 1)
+
+
+def grayscale(x: torch.Tensor) -> torch.Tensor:
+    weights = torch.tensor(LUMA, dtype=x.dtype, device=x.device).view(1, 3, 1, 1)
+    return (x * weights).sum(dim=1, keepdim=True).expand_as(x)
+
+
+def apply_filters(
+    image: torch.Tensor,
+    brightness: float = 0.0,
+    contrast: float = 1.0,
+    saturation: float = 1.0,
+    sharpness: float = 1.0,
+    blur: int = 0,
+    sharpen: int = 0,
+    smooth: int = 0,
+    smooth_more: int = 0,
+    gaussian_blur_radius: float = 0.0,
+    edge_enhance: float = 0.0,
+    detail_enhance: bool = False,
+    fuse_kernels: bool = True,
+    gaussian_mode: str = "auto",
+) -> torch.Tensor:
+    """Apply the ImageFilters adjustments to a whole BHWC batch in float on its own device.
+
+    Adjustments run in the same order as the PIL implementation and only touch the RGB channels. With
+    ``fuse_kernels`` consecutive blur, smooth and smooth_more passes are folded into one compiled kernel and the image
+    is convolved once, which matches PIL's per pass result including its border (see ``split_chain`` and
+    ``fused_filter_chain``). Sharpen and single passes always run pass by pass like PIL.
+    """
+    if image.dim() == 3:
+        image = image.unsqueeze(0)
+
+    x = image[..., :3].permute(0, 3, 1, 2).float()
+
+    if brightness != 0.0:
+        x = (x + brightness).clamp_(0, 1)
+
+    if contrast != 1.0:
+        x = (x * contrast).clamp_(0, 1)
+
+    if saturation != 1.0:
+        x = blend(grayscale(x), x, saturation)
+
+    if sharpness != 1.0:
+        x = blend(kernel_filter(x, pil_kernel("smooth", x.device)), x, sharpness)
+
+    chain = (("blur", blur), ("sharpen", sharpen), ("smooth", smooth), ("smooth_more", smooth_more))
+    for fusable, run in split_chain(chain):
+        if fuse_kernels and fusable and sum(passes for _, passes in run) > 1:
+            x = fused_filter_chain(x, run)
+        else:
+            x = filter_chain(x, run)
+
+    if gaussian_blur_radius > 0.0:
+        x = gaussian_blur(x, gaussian_blur_radius, gaussian_mode)
+
+    if edge_enhance > 0.0:
+        x = torch.lerp(x, kernel_filter(x, pil_kernel("edge_enhance_more", x.device)), edge_enhance)
+
+    if detail_enhance:
+        x = kernel_filter(x, pil_kernel("detail", x.device))
+
+    output = image.clone() if image.shape[-1] > 3 else torch.empty_like(image, dtype=torch.float32)
+    output[..., :3] = x.permute(0, 2, 3, 1)
+    return output
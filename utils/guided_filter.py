@@ -0,0 +1,98 @@
+import torch
+import torch.nn.functional as F
+
+# Pixels filtered per chunk, the colour guided filter keeps a few dozen full-size maps alive at once
+CHUNK_PIXELS = 1 << 21
+
+
+def box_filter(x: torch.Tensor, radius: int) -> torch.Tensor:
+    """Mean over a (2r+1)² window of the last two dims through running sums, reflecting the border like OpenCV"""
+    if radius <= 0:
+        return x
+
+    shape = x.shape
+    x = x.reshape(-1, 1, *shape[-2:])
+    for dim in (-1, -2):
+        size = x.shape[dim]
+        pad = (radius, radius, 0, 0) if dim == -1 else (0, 0, radius, radius)
+        # Reflect can only reach size - 1 pixels out, very large windows fall back to replicate
+        padded = F.pad(x, pad, mode="reflect" if radius < size else "replicate")
+        summed = F.pad(padded.cumsum(dim), (1, 0, 0, 0) if dim == -1 else (0, 0, 1, 0))
+        x = (summed.narrow(dim, 2 * radius + 1, size) - summed.narrow(dim, 0, size)) / (2 * radius + 1)
+    return x.reshape(shape)
+
+
+def guide_statistics(guide: torch.Tensor, radius: int, eps: float):
+    """Window mean of the guide and the inverse of its regularised covariance, shared by every pass.
+
+    ``guide`` is B×3×H×W (colour guide, a 3×3 inverse per pixel) or B×1×H×W. The inverse is B×G×G×H×W.
+    """
+    channels = guide.shape[1]
+    mean = box_filter(guide, radius)
+    var = box_filter(guide.unsqueeze(2) * guide.unsqueeze(1), radius) - mean.unsqueeze(2) * mean.unsqueeze(1)
+    if channels == 1:
+        return mean, 1.0 / (var + eps)
+
+    # Closed-form inverse of Σ + εU, a batched linalg.solve on millions of 3×3 systems is far slower
+    rr, rg, rb = var[:, 0, 0] + eps, var[:, 0, 1], var[:, 0, 2]
+    gg, gb, bb = var[:, 1, 1] + eps, var[:, 1, 2], var[:, 2, 2] + eps
+    inv_rr, inv_rg, inv_rb = gg * bb - gb * gb, gb * rb - rg * bb, rg * gb - gg * rb
+    inv_gg, inv_gb, inv_bb = rr * bb - rb * rb, rb * rg - rr * gb, rr * gg - rg * rg
+    det = rr * inv_rr + rg * inv_rg + rb * inv_rb
+    inverse = torch.stack([
+        torch.stack([inv_rr, inv_rg, inv_rb], dim=1),
+        torch.stack([inv_rg, inv_gg, inv_gb], dim=1),
+        torch.stack([inv_rb, inv_gb, inv_bb], dim=1),
+    ], dim=1)
+    return mean, inverse / det.view(det.shape[0], 1, 1, *det.shape[1:])
+
+
+def guided_coefficients(guide: torch.Tensor, source: torch.Tensor, radius: int, statistics):
+    """Per-pixel linear coefficients (a, b) of He et al.'s guided filter, box-averaged.
+
+    ``source`` is B×C×H×W. Returns ``a`` as B×G×C×H×W and ``b`` as B×C×H×W.
+    """
+    mean_guide, inverse = statistics
+    mean_source = box_filter(source, radius)
+    cov = box_filter(guide.unsqueeze(2) * source.unsqueeze(1), radius) \
+        - mean_guide.unsqueeze(2) * mean_source.unsqueeze(1)
+
+    a = sum(inverse[:, :, j].unsqueeze(2) * cov[:, j].unsqueeze(1) for j in range(guide.shape[1]))
+    b = mean_source - (a * mean_guide.unsqueeze(2)).sum(dim=1)
+    return box_filter(a, radius), box_filter(b, radius)
+
+
+def guided_filter(guide: torch.Tensor, source: torch.Tensor, radius: int, eps: float, passes: int = 1,
+                  subsample: int = 1) -> torch.Tensor:
+    """Guided filter over a whole BHWC batch, ``passes`` times like repeated cv2.ximgproc.guidedFilter calls.
+
+    ``eps`` is in [0, 1]² units. With ``subsample`` above 1 this is the fast guided filter: the coefficients are
+    solved at 1/subsample resolution with a proportionally smaller radius, then upsampled and applied to the
+    full-resolution guide.
+    """
+    output = torch.empty(source.shape, dtype=torch.float32, device=source.device)
+    frames_per_chunk = max(1, CHUNK_PIXELS // max(1, source[0, ..., 0].numel()))
+    for start in range(0, source.shape[0], frames_per_chunk):
+        chunk_guide = guide[start:start + frames_per_chunk].permute(0, 3, 1, 2).float()
+        chunk = source[start:start + frames_per_chunk].permute(0, 3, 1, 2).float()
+
+        size = chunk_guide.shape[-2:]
+        if subsample > 1:
+            small_guide = F.interpolate(chunk_guide, scale_factor=1 / subsample, mode="area")
+            small_radius = max(1, round(radius / subsample))
+            statistics = guide_statistics(small_guide, small_radius, eps)
+        else:
+            statistics = guide_statistics(chunk_guide, radius, eps)
+
+        for _ in range(passes):
+            if subsample > 1:
+                small = F.interpolate(chunk, scale_factor=1 / subsample, mode="area")
+                a, b = guided_coefficients(small_guide, small, small_radius, statistics)
+                a = F.interpolate(a.flatten(1, 2), size=size, mode="bilinear").unflatten(1, a.shape[1:3])
+                b = F.interpolate(b, size=size, mode="bilinear")
+            else:
+                a, b = guided_coefficients(chunk_guide, chunk, radius, statistics)
+            chunk = (a * chunk_guide.unsqueeze(2)).sum(dim=1) + b
+
+        output[start:start + frames_per_chunk] = chunk.permute(0, 2, 3, 1)
+    return output
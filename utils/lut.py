@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+import torch
+from PIL import ImageFilter
+from colour import LUT3D, LUT3x1D
+from typing import Union
+from .cache import LRUCache
+from .cube import load_cube
+from .lut_engine import compose_luts
+
+# Parsed LUTs shared by every LUT node in the process, keyed by (resolved path, mtime, clip_values)
+LUT_CACHE = LRUCache(maxsize=32)
+# Baked LUT stacks, keyed by every stage's file identity and settings plus the bake resolution and device
+LUT_STACK_CACHE = LRUCache(maxsize=16)
+
+
+class LutEntry:
+    """A `.cube` file parsed once, with the PIL filter and the colour LUT built lazily on first use."""
+
+    def __init__(self, path: str, clip_values: bool = True):
+        self.path = path
+        self.clip_values = clip_values
+        self.header, self.table = load_cube(path)
+        self._filter = None
+        self._lut3d = None
+        self._tensors = {}
+
+    @property
+    def title(self) -> str:
+        return self.header.title or os.path.splitext(os.path.basename(self.path))[0]
+
+    @property
+    def size(self) -> int:
+        return self.header.size
+
+    @property
+    def domain(self) -> np.ndarray:
+        return self.header.domain
+
+    @property
+    def clipped_table(self) -> np.ndarray:
+        table = self.table
+        if not self.clip_values:
+            return table
+        axes = tuple(range(table.ndim - 1))
+        if (table.min(axis=axes) >= self.domain[0]).all() and (table.max(axis=axes) <= self.domain[1]).all():
+            # Nothing to clip, keep the (possibly memory-mapped) table shared instead of copying it
+            return table
+        return np.clip(table, self.domain[0], self.domain[1])
+
+    @property
+    def filter(self) -> ImageFilter.Color3DLUT:
+        """PIL filter built from the same (clipped) table as ``tensor``, so both backends grade alike"""
+        if self._filter is None:
+            table = self.clipped_table
+            if self.header.dimensions == 1:
+                table = bake_1d_table(table)
+            self._filter = ImageFilter.Color3DLUT(table.shape[0], table, 3)
+        return self._filter
+
+    @property
+    def lut3d(self):
+        if self._lut3d is None:
+            table = self.clipped_table
+            if self.header.dimensions == 1:
+                self._lut3d = LUT3x1D(table, name=self.title, domain=self.domain)
+            else:
+                # colour indexes 3D tables as [r, g, b], the `.cube` file order is [b, g, r]
+                self._lut3d = LUT3D(table.transpose(2, 1, 0, 3), name=self.title, domain=self.domain)
+        return self._lut3d
+
+    def tensor(self, device=None) -> torch.Tensor:
+        """The (clipped) LUT table as a float32 tensor in `.cube` file order, cached per device"""
+        key = str(device)
+        if key not in self._tensors:
+            self._tensors[key] = torch.tensor(self.clipped_table, device=device)
+        return self._tensors[key]
+
+
+def get_lut(path: Union[str, os.PathLike], clip_values: bool = True) -> LutEntry:
+    """Return the cached entry for a LUT file, re-parsing it only when the file changes on disk."""
+    path = os.path.realpath(path)
+    key = (path, os.stat(path).st_mtime_ns, clip_values)
+    return LUT_CACHE.get(key, lambda: LutEntry(path, clip_values))
+
+
+def get_lut_stack(stages, size: int = 33, interpolation: str = "trilinear", device=None) -> torch.Tensor:
+    """Return the cached single-table bake of ``(path, strength, gamma_correction, clip_values)`` stages"""
+    entries = [(get_lut(path, clip_values), strength, gamma_correction)
+               for path, strength, gamma_correction, clip_values in stages]
+    key = (tuple((entry.path, os.stat(entry.path).st_mtime_ns, entry.clip_values, strength, gamma_correction)
+                 for entry, strength, gamma_correction in entries), size, interpolation, str(device))
+
+    def bake():
+        return compose_luts([(entry.tensor(device), entry.domain, strength, gamma_correction)
+                             for entry, strength, gamma_correction in entries], size, interpolation, device)
+
+    return LUT_STACK_CACHE.get(key, bake)
+
+
+def bake_1d_table(table: np.ndarray, size: int = 33) -> np.ndarray:
+    """Expand a 1D LUT (size, 3) into an equivalent 3D table in `.cube` file order"""
+    grid = np.linspace(0, 1, size, dtype=np.float32)
+    lut_grid = np.linspace(0, 1, len(table), dtype=np.float32)
+    r, g, b = (np.interp(grid, lut_grid, table[:, channel]).astype(np.float32) for channel in range(3))
+    baked = np.empty((size, size, size, 3), dtype=np.float32)
+    baked[..., 0] = r[None, None, :]
+    baked[..., 1] = g[None, :, None]
+    baked[..., 2] = b[:, None, None]
+    return baked
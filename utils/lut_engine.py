@@ -0,0 +1,137 @@
+import torch
+import torch.nn.functional as F
+from typing import Optional
+
+# Tables are indexed in `.cube` file order: table[b, g, r] -> (r, g, b) for 3D LUTs, table[i] -> (r, g, b) for 1D LUTs
+INTERPOLATIONS = ["trilinear", "tetrahedral"]
+# Pixels graded per chunk, bounds the float32 temporaries of a lookup to a few hundred MB
+CHUNK_PIXELS = 1 << 22
+
+
+def apply_lut(
+    image: torch.Tensor,
+    table: torch.Tensor,
+    domain: Optional[torch.Tensor] = None,
+    interpolation: str = "trilinear",
+    strength: float = 1.0,
+    gamma_correction: bool = False,
+    dtype: torch.dtype = torch.float32,
+    chunk_pixels: int = CHUNK_PIXELS,
+) -> torch.Tensor:
+    """Grade a whole BHWC image batch with a 1D or 3D LUT in a single vectorised pass.
+
+    The LUT table must live on the image's device. ``domain`` is the LUT's (2, 3) DOMAIN_MIN/DOMAIN_MAX, the
+    image is mapped into it before the lookup and back afterwards, the same way LutsAdvanced does it.
+
+    The lookup always runs in float32, ``dtype`` only sets the output precision. Frames are graded in chunks of
+    roughly ``chunk_pixels`` pixels straight into the preallocated output, and any alpha channel is copied through.
+    """
+    output = torch.empty(image.shape, dtype=dtype, device=image.device)
+    if image.shape[-1] > 3:
+        output[..., 3:] = image[..., 3:]
+
+    dom_min = dom_scale = None
+    if domain is not None:
+        domain = torch.as_tensor(domain, dtype=torch.float32, device=image.device)
+        if not torch.equal(domain, torch.tensor([[0., 0., 0.], [1., 1., 1.]], device=image.device)):
+            dom_min = domain[0]
+            dom_scale = domain[1] - domain[0]
+
+    table = table.to(dtype=torch.float32)
+    frames_per_chunk = max(1, chunk_pixels // max(1, image[0, ..., 0].numel()))
+    for start in range(0, image.shape[0], frames_per_chunk):
+        rgb = image[start:start + frames_per_chunk, ..., :3].float()
+        output[start:start + frames_per_chunk, ..., :3] = _grade(
+            rgb, table, dom_min, dom_scale, interpolation, strength, gamma_correction)
+
+    return output
+
+
+def _grade(rgb, table, dom_min, dom_scale, interpolation, strength, gamma_correction):
+    lut_input = rgb
+    if dom_scale is not None:
+        lut_input = lut_input * dom_scale + dom_min
+
+    if gamma_correction:
+        lut_input = lut_input.clamp(min=0) ** (1 / 2.2)
+
+    if dom_scale is not None:
+        lut_input = (lut_input - dom_min) / dom_scale
+
+    if table.dim() == 2:
+        output = _lookup_1d(lut_input, table)
+    elif interpolation == "tetrahedral":
+        output = _lookup_tetrahedral(lut_input, table)
+    else:
+        output = _lookup_trilinear(lut_input, table)
+
+    if gamma_correction:
+        output = output.clamp(min=0) ** 2.2
+
+    if dom_scale is not None:
+        output = (output - dom_min) / dom_scale
+
+    if strength < 1.0:
+        output = torch.lerp(rgb, output, strength)
+
+    return output
+
+
+def identity_lut(size: int, device=None) -> torch.Tensor:
+    """A (size, size, size, 3) table in `.cube` file order that maps every colour to itself"""
+    grid = torch.linspace(0, 1, size, device=device)
+    b, g, r = torch.meshgrid(grid, grid, grid, indexing="ij")
+    return torch.stack([r, g, b], dim=-1)
+
+
+def compose_luts(stages, size: int = 33, interpolation: str = "trilinear", device=None) -> torch.Tensor:
+    """Bake an ordered list of grades into a single 3D table.
+
+    Each stage is a ``(table, domain, strength, gamma_correction)`` tuple applied like LutsAdvanced would, but to
+    the lattice of a ``size``³ identity LUT instead of an image, so the result grades an image in one lookup.
+    """
+    table = identity_lut(size, device)
+    for stage_table, domain, strength, gamma_correction in stages:
+        # The identity lattice is already shaped like a BHWC batch with B = H = W = size
+        table = apply_lut(table, stage_table, domain, interpolation, strength, gamma_correction)
+    return table.contiguous()
+
+
+def _lookup_1d(x: torch.Tensor, table: torch.Tensor) -> torch.Tensor:
+    size = table.shape[0]
+    position = x.clamp(0, 1) * (size - 1)
+    index = position.floor().clamp(max=size - 2)
+    fraction = position - index
+    index = index.long() * 3 + torch.arange(3, device=x.device)
+
+    flat = table.reshape(-1)
+    return torch.lerp(flat[index], flat[index + 3], fraction)
+
+
+def _lookup_trilinear(x: torch.Tensor, table: torch.Tensor) -> torch.Tensor:
+    # grid_sample reads the grid as (x, y, z) = (W, H, D) = (r, g, b), which is exactly the file order
+    volume = table.permute(3, 0, 1, 2).unsqueeze(0)
+    grid = (x.clamp(0, 1) * 2 - 1).unsqueeze(0)
+    output = F.grid_sample(volume, grid, mode="bilinear", padding_mode="border", align_corners=True)
+    return output.squeeze(0).permute(1, 2, 3, 0)
+
+
+def _lookup_tetrahedral(x: torch.Tensor, table: torch.Tensor) -> torch.Tensor:
+    size = table.shape[0]
+    position = x.clamp(0, 1) * (size - 1)
+    index = position.floor().clamp(max=size - 2)
+    fraction = position - index
+
+    strides = torch.tensor([1, size, size * size], device=x.device)
+    base = (index.long() * strides).sum(-1)
+
+    # Walk from the base corner towards the opposite corner along the axes with the largest fractions first
+    fraction, order = fraction.sort(dim=-1, descending=True)
+    steps = strides[order]
+    corner1 = base + steps[..., 0]
+    corner2 = corner1 + steps[..., 1]
+    corner3 = base + strides.sum()
+
+    flat = table.reshape(-1, 3)
+    f0, f1, f2 = fraction[..., 0:1], fraction[..., 1:2], fraction[..., 2:3]
+    return (1 - f0) * flat[base] + (f0 - f1) * flat[corner1] + (f1 - f2) * flat[corner2] + f2 * flat[corner3]
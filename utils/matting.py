@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import torch
+from pymatting import estimate_alpha_cf, estimate_foreground_ml
+from .guided_filter import guided_filter
+
+# Regularisation of the guided upsampling, in [0, 1]² units, low enough to follow hair-level edges in the guide
+UPSAMPLE_EPS = 1e-4
+
+
+def trimap(mask: np.ndarray, foreground_threshold: int, background_threshold: int, erode_size: int):
+    """rembg's trimap: thresholded foreground and background, each eroded by an ``erode_size`` square.
+
+    ``mask`` is HxW in 0-1. Returns the boolean foreground and background maps; everything else is unknown.
+    """
+    mask = mask * 255.0
+    foreground = (mask > foreground_threshold).astype(np.uint8)
+    background = (mask < background_threshold).astype(np.uint8)
+    if erode_size > 0:
+        kernel = np.ones((erode_size, erode_size), dtype=np.uint8)
+        # Like scipy's binary_erosion, the foreground erodes from the image border and the background does not
+        foreground = cv2.erode(foreground, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+        background = cv2.erode(background, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=1)
+    return foreground.astype(bool), background.astype(bool)
+
+
+def fast_alpha_matting(image: np.ndarray, mask: np.ndarray, foreground_threshold: int = 240,
+                       background_threshold: int = 10, erode_size: int = 10, downscale: int = 4,
+                       estimate_foreground: bool = True):
+    """Closed-form matting solved at 1/``downscale`` resolution inside the unknown band only.
+
+    The trimap is built at full resolution. Closed-form alpha and the foreground colours are solved on the
+    downscaled bounding box of the unknown band, the alpha is upsampled with a guided filter on the
+    full-resolution image, and the known regions are written back exactly. ``image`` is HxWx3 and ``mask`` HxW,
+    both float in 0-1. Returns ``(foreground, alpha)`` as HxWx3 and HxW float32 arrays, the foreground is None
+    when ``estimate_foreground`` is off.
+    """
+    foreground_known, background_known = trimap(mask, foreground_threshold, background_threshold, erode_size)
+    alpha = foreground_known.astype(np.float32)
+    foreground = image.astype(np.float32, copy=True) if estimate_foreground else None
+
+    unknown = ~(foreground_known | background_known)
+    rows, cols = np.nonzero(unknown.any(axis=1))[0], np.nonzero(unknown.any(axis=0))[0]
+    if len(rows) == 0:
+        return foreground, alpha
+
+    # Unknown band bounding box, with a margin of known pixels for the solver to anchor to
+    height, width = mask.shape
+    margin = 2 * max(downscale, 1) + max(erode_size, 1)
+    y0, y1 = max(0, rows[0] - margin), min(height, rows[-1] + 1 + margin)
+    x0, x1 = max(0, cols[0] - margin), min(width, cols[-1] + 1 + margin)
+    crop = image[y0:y1, x0:x1].astype(np.float64)
+    crop_size = (x1 - x0, y1 - y0)
+    small_size = (max(1, round(crop_size[0] / downscale)), max(1, round(crop_size[1] / downscale)))
+
+    # A low resolution pixel is only known when every full resolution pixel it covers is
+    small_image = cv2.resize(crop, small_size, interpolation=cv2.INTER_AREA)
+    small_foreground = cv2.resize(foreground_known[y0:y1, x0:x1].astype(np.float32), small_size,
+                                  interpolation=cv2.INTER_AREA) >= 1.0 - 1e-6
+    small_background = cv2.resize(background_known[y0:y1, x0:x1].astype(np.float32), small_size,
+                                  interpolation=cv2.INTER_AREA) >= 1.0 - 1e-6
+    small_trimap = np.full(small_size[::-1], 0.5)
+    small_trimap[small_foreground] = 1.0
+    small_trimap[small_background] = 0.0
+
+    small_alpha = np.clip(estimate_alpha_cf(small_image, small_trimap), 0, 1)
+
+    # Guided upsampling: the low resolution alpha takes its edges from the full resolution image
+    upsampled = cv2.resize(small_alpha.astype(np.float32), crop_size, interpolation=cv2.INTER_LINEAR)
+    guide = torch.from_numpy(crop.astype(np.float32)).unsqueeze(0)
+    refined = guided_filter(guide, torch.from_numpy(upsampled)[None, :, :, None], 2 * downscale, UPSAMPLE_EPS,
+                            subsample=downscale)
+    crop_alpha = np.clip(refined[0, :, :, 0].numpy(), 0, 1)
+    crop_unknown = unknown[y0:y1, x0:x1]
+    alpha[y0:y1, x0:x1][crop_unknown] = crop_alpha[crop_unknown]
+    if not estimate_foreground:
+        return foreground, alpha
+
+    # Foreground colours: the image plus the upsampled low resolution correction
+    small_colours = estimate_foreground_ml(small_image, small_alpha)
+    correction = cv2.resize((small_colours - small_image).astype(np.float32), crop_size,
+                            interpolation=cv2.INTER_LINEAR)
+    foreground[y0:y1, x0:x1] = np.clip(crop + correction, 0, 1)
+    return foreground, alpha
@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+
+from typing import Callable, Iterable, List, Tuple
+
+_END = object()
+
+
+class Pipeline:
+    """Producer/consumer pipeline with one thread per stage, joined by bounded queues.
+
+    ``stages`` is a list of ``(name, fn)``. Every item passes through each ``fn`` in order, and stage n works on
+    item i + 1 while stage n + 1 is still busy with item i. The bounded queues keep at most ``maxsize`` items
+    waiting between two stages, so a slow stage holds back the stages before it instead of piling up memory.
+    Time spent inside each stage is accumulated in ``timings`` so the bottleneck can be reported.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable]], maxsize: int = 2):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.timings = {name: 0.0 for name, _ in stages}
+        self.wall = 0.0
+
+    def run(self, items: Iterable):
+        """Yield each item's result from the last stage, in order. The first stage error is raised here."""
+        started = time.perf_counter()
+        stop = threading.Event()
+        queues = [queue.Queue(self.maxsize) for _ in range(len(self.stages) + 1)]
+        errors = []
+
+        def put(target, item):
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(source):
+            while not stop.is_set():
+                try:
+                    return source.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return _END
+
+        def feed():
+            try:
+                for item in items:
+                    if not put(queues[0], item):
+                        return
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                return
+            put(queues[0], _END)
+
+        def work(index, name, fn):
+            while True:
+                item = get(queues[index])
+                if item is _END:
+                    put(queues[index + 1], _END)
+                    return
+                began = time.perf_counter()
+                try:
+                    result = fn(item)
+                except BaseException as e:
+                    errors.append(e)
+                    stop.set()
+                    return
+                self.timings[name] += time.perf_counter() - began
+                if not put(queues[index + 1], result):
+                    return
+
+        threads = [threading.Thread(target=feed, name="pipeline_feed", daemon=True)]
+        for index, (name, fn) in enumerate(self.stages):
+            threads.append(threading.Thread(target=work, args=(index, name, fn), name=f"pipeline_{name}", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                result = get(queues[-1])
+                if result is _END:
+                    break
+                yield result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall += time.perf_counter() - started
+
+        if errors:
+            raise errors[0]
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
+        return f"{stages}, wall {self.wall:.2f}s"
@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Input resolution and normalisation of every rembg model, as rembg's own sessions preprocess them
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+MODEL_INPUTS = {
+    "u2net": (320, IMAGENET_MEAN, (0.229, 0.224, 0.225)),
+    "u2netp": (320, IMAGENET_MEAN, (0.229, 0.224, 0.225)),
+    "u2net_human_seg": (320, IMAGENET_MEAN, (0.229, 0.224, 0.225)),
+    "silueta": (320, IMAGENET_MEAN, (0.229, 0.224, 0.225)),
+    "isnet-general-use": (1024, IMAGENET_MEAN, (1.0, 1.0, 1.0)),
+    "isnet-anime": (1024, IMAGENET_MEAN, (1.0, 1.0, 1.0)),
+}
+
+# Models whose ONNX graph turned out to take a single image at a time
+_SINGLE_IMAGE_MODELS = set()
+
+_POST_PROCESS_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+
+def preprocess(images: torch.Tensor, model: str) -> np.ndarray:
+    """BHWC float images to the model's NCHW input: resized, scaled by each image's maximum and normalised"""
+    size, mean, std = MODEL_INPUTS[model]
+    x = images[..., :3].permute(0, 3, 1, 2).float()
+    x = F.interpolate(x, size=(size, size), mode="bicubic", antialias=True, align_corners=False).clamp(0, 1)
+    x = x / x.amax(dim=(1, 2, 3), keepdim=True).clamp_min(1e-8)
+    mean = torch.tensor(mean, dtype=x.dtype, device=x.device).view(1, 3, 1, 1)
+    std = torch.tensor(std, dtype=x.dtype, device=x.device).view(1, 3, 1, 1)
+    return ((x - mean) / std).cpu().numpy().astype(np.float32)
+
+
+def is_batch_size_error(error: Exception) -> bool:
+    """Whether ``error`` is onnxruntime rejecting an input's dimensions, what a fixed batch of one raises"""
+    return type(error).__name__ == "InvalidArgument" and "invalid dimensions" in str(error)
+
+
+def run_session(session, model: str, inputs: np.ndarray, chunk_size: int) -> np.ndarray:
+    """Raw model predictions for a preprocessed batch, ``chunk_size`` images per ``InferenceSession.run``.
+
+    A model whose input declares a fixed batch size runs at that size. Models that only reject larger chunks when
+    run fall back to one image per run and are remembered for the rest of the process. Any other error propagates.
+    """
+    model_input = session.inner_session.get_inputs()[0]
+    batch = model_input.shape[0] if model_input.shape else None
+    if isinstance(batch, int) and batch > 0:
+        chunk_size = batch
+    elif model in _SINGLE_IMAGE_MODELS:
+        chunk_size = 1
+
+    predictions = []
+    start = 0
+    while start < len(inputs):
+        chunk = inputs[start:start + chunk_size]
+        try:
+            predictions.append(session.inner_session.run(None, {model_input.name: chunk})[0][:, 0])
+        except Exception as e:
+            if chunk_size == 1 or not is_batch_size_error(e):
+                raise
+            print(f"\033[93m[Shibiko AI] \033[31mrembg model {model} does not take batches, "
+                  f"running one image at a time\033[0m")
+            _SINGLE_IMAGE_MODELS.add(model)
+            chunk_size = 1
+            continue
+        start += len(chunk)
+    return np.concatenate(predictions, axis=0)
+
+
+def predictions_to_masks(predictions: np.ndarray, size, post_process: bool = False) -> torch.Tensor:
+    """Min-max normalise each prediction like rembg does, resize it to ``size`` (H, W) and optionally clean it up"""
+    pred = torch.from_numpy(predictions).float()
+    low = pred.amin(dim=(1, 2), keepdim=True)
+    high = pred.amax(dim=(1, 2), keepdim=True)
+    pred = (pred - low) / (high - low).clamp_min(1e-8)
+
+    downscale = size[0] < pred.shape[1] or size[1] < pred.shape[2]
+    masks = F.interpolate(pred.unsqueeze(1), size=tuple(size), mode="bicubic", antialias=downscale,
+                          align_corners=False)[:, 0].clamp(0, 1)
+
+    if post_process:
+        masks = torch.from_numpy(np.stack([post_process_mask(mask) for mask in masks.numpy()]))
+    return masks
+
+
+def post_process_mask(mask: np.ndarray) -> np.ndarray:
+    """rembg's mask post processing (morphological open, blur, threshold) on a float mask"""
+    mask = (mask * 255).astype(np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, _POST_PROCESS_KERNEL)
+    mask = cv2.GaussianBlur(mask, (5, 5), sigmaX=2, sigmaY=2, borderType=cv2.BORDER_DEFAULT)
+    return np.where(mask < 127, 0.0, 1.0).astype(np.float32)
+
+
+def composite(images: torch.Tensor, masks: torch.Tensor, only_mask: bool = False, putalpha: bool = False,
+              bgcolor=None, transparency: bool = True) -> torch.Tensor:
+    """rembg's cutout and background fill for a whole batch, matching what its PIL compositing produces.
+
+    ``images`` is BHWC, ``masks`` is BHW in 0-1 and ``bgcolor`` an RGBA tuple in 0-255. Returns RGBA when
+    ``transparency`` is set and RGB otherwise.
+    """
+    m = masks.unsqueeze(-1).to(images.device, images.dtype)
+    if only_mask:
+        rgb = m.expand(-1, -1, -1, 3)
+        alpha = torch.ones_like(m)
+    else:
+        # putalpha keeps the colours, a plain cutout composites them onto transparent black
+        rgb = images[..., :3] if putalpha else images[..., :3] * m
+        alpha = m
+        if bgcolor is not None:
+            # The cutout is pasted onto the colour through its own alpha
+            color = torch.tensor(bgcolor, dtype=images.dtype, device=images.device) / 255.0
+            rgb = rgb * m + color[:3] * (1 - m)
+            alpha = alpha * m + color[3] * (1 - m)
+
+    if transparency:
+        return torch.cat([rgb, alpha], dim=-1)
+    return rgb.contiguous()
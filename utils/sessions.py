@@ -0,0 +1,64 @@
+import os
+import threading
+
+import folder_paths
+from typing import Dict, Iterable, Optional
+from .cache import LRUCache
+
+REMBG_HOME = os.path.join(folder_paths.models_dir, 'rembg')
+
+# rembg ONNX sessions shared by every node in the process, keyed by (model, providers, session options)
+SESSION_CACHE = LRUCache(maxsize=2)
+
+_home_lock = threading.Lock()
+_home_ready = False
+
+
+def rembg_home() -> str:
+    """Point rembg's model downloads at the ComfyUI models directory, once per process"""
+    global _home_ready
+    with _home_lock:
+        if not _home_ready:
+            os.environ['U2NET_HOME'] = REMBG_HOME
+            os.makedirs(REMBG_HOME, exist_ok=True)
+            _home_ready = True
+    return REMBG_HOME
+
+
+def session_key(model: str, providers: Optional[Iterable[str]] = None, **options):
+    return model, tuple(providers or ()), tuple(sorted(options.items()))
+
+
+def get_session(model: str, providers: Optional[Iterable[str]] = None, max_sessions: Optional[int] = None,
+                **options):
+    """Cached rembg session for ``model``. The ONNX model is read from disk only when it is not resident.
+
+    ``max_sessions`` resizes the cache first, evicting the least recently used sessions beyond it.
+    """
+    if max_sessions is not None and max_sessions != SESSION_CACHE.maxsize:
+        SESSION_CACHE.resize(max_sessions)
+
+    def load():
+        from rembg import new_session
+
+        rembg_home()
+        print(f'\033[93m[Shibiko AI] \033[31mLoading rembg model {model}\033[0m')
+        return new_session(model, list(providers) if providers else None, **options)
+
+    return SESSION_CACHE.get(session_key(model, providers, **options), load)
+
+
+def unload_sessions(model: Optional[str] = None):
+    """Drop every cached session, or only the sessions of ``model``"""
+    if model is None:
+        SESSION_CACHE.clear()
+        return
+    for key in SESSION_CACHE.keys():
+        if key[0] == model:
+            SESSION_CACHE.pop(key)
+
+
+def session_stats() -> Dict:
+    stats = SESSION_CACHE.stats()
+    stats['models'] = [key[0] for key in SESSION_CACHE.keys()]
+    return stats
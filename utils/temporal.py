@@ -0,0 +1,92 @@
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Changes are measured on the means of blocks this size, so per-pixel noise averages out before it is compared
+BLOCK_SIZE = 8
+
+
+def tile_changes(frame: torch.Tensor, reference: torch.Tensor, tile: int) -> torch.Tensor:
+    """Largest block-mean change, in 0-255 units, inside each ``tile``×``tile`` tile of two HWC or BHWC frames.
+
+    Comparing block means rather than pixels ignores sensor noise, while taking the largest block per tile still
+    catches small objects moving inside an otherwise static tile. Returns a (rows, cols) or (B, rows, cols) tensor.
+    """
+    squeeze = frame.dim() == 3
+    if squeeze:
+        frame, reference = frame.unsqueeze(0), reference.unsqueeze(0)
+
+    block = min(BLOCK_SIZE, tile)
+    means = F.avg_pool2d((frame.float() - reference.float()).permute(0, 3, 1, 2), block, ceil_mode=True)
+    changes = F.max_pool2d(means.abs().amax(dim=1, keepdim=True), max(1, tile // block), ceil_mode=True)
+    changes = changes[:, 0] * 255.0
+    return changes[0] if squeeze else changes
+
+
+def changed_runs(changed: torch.Tensor) -> List[Tuple[int, int, int]]:
+    """Horizontal runs of changed tiles in a (rows, cols) boolean map, as (row, first col, last col + 1)"""
+    runs = []
+    for row, line in enumerate(changed.tolist()):
+        start = None
+        for col, value in enumerate(line + [False]):
+            if value and start is None:
+                start = col
+            elif not value and start is not None:
+                runs.append((row, start, col))
+                start = None
+    return runs
+
+
+def plan_keyframes(images: torch.Tensor, threshold: float, interval: int = 0, size: int = 256, tile: int = 16):
+    """Decide which frames of a static-camera clip need fresh inference and which can reuse a keyframe.
+
+    Every frame is compared with the last keyframe at low resolution after compensating for any global shift
+    measured with phase correlation, so a small camera drift does not force inference. A frame whose largest
+    tile change (see ``tile_changes``) stays under ``threshold`` reuses the keyframe, others become keyframes,
+    and so does every frame ``interval`` frames after a keyframe when ``interval`` is positive.
+    Returns one ``(keyframe index, (dx, dy))`` per frame, with the shift in full-resolution pixels.
+    """
+    total, height, width = images.shape[:3]
+    scale = min(1.0, size / max(height, width))
+    low_size = (max(8, round(width * scale)), max(8, round(height * scale)))
+    window = cv2.createHanningWindow(low_size, cv2.CV_64F)
+
+    plan = []
+    key_index, key_low = None, None
+    for idx in range(total):
+        low = cv2.resize(images[idx, ..., :3].float().mean(dim=-1).cpu().numpy(), low_size,
+                         interpolation=cv2.INTER_AREA).astype(np.float64)
+        shift = (0.0, 0.0)
+        reuse = key_index is not None and (interval <= 0 or idx - key_index < interval)
+        if reuse:
+            # phaseCorrelate applies the window to its inputs in place
+            (dx, dy), response = cv2.phaseCorrelate(key_low.copy(), low.copy(), window)
+            warped = cv2.warpAffine(key_low, np.float64([[1, 0, dx], [0, 1, dy]]), low_size,
+                                    borderMode=cv2.BORDER_REPLICATE)
+            # Pixels shifted in from outside the keyframe are not compared
+            margin = int(np.ceil(max(abs(dx), abs(dy)))) + 1
+            if response < 0.1 or 2 * margin >= min(low_size):
+                reuse = False
+            else:
+                inner = (slice(margin, -margin), slice(margin, -margin))
+                change = tile_changes(torch.from_numpy(low[inner])[..., None],
+                                      torch.from_numpy(warped[inner])[..., None], tile)
+                reuse = float(change.max()) < threshold
+                shift = (dx / scale, dy / scale)
+
+        if not reuse:
+            key_index, key_low, shift = idx, low, (0.0, 0.0)
+        plan.append((key_index, shift))
+    return plan
+
+
+def warp_mask(mask: np.ndarray, shift) -> np.ndarray:
+    """Translate an HxW mask by ``(dx, dy)`` pixels, repeating its edges"""
+    if shift == (0.0, 0.0):
+        return mask
+    height, width = mask.shape
+    matrix = np.float32([[1, 0, shift[0]], [0, 1, shift[1]]])
+    return cv2.warpAffine(mask, matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
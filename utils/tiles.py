@@ -0,0 +1,78 @@
+import math
+import os
+import tempfile
+
+import torch
+
+from typing import List, Optional, Sequence, Tuple
+
+# Bytes of one float32 value
+FLOAT_BYTES = 4
+
+
+def budget_tile_size(budget: int, scale: int, channels: int = 3, multiple: int = 16, minimum: int = 64) -> int:
+    """Side of the largest square input tile whose input, upscaled output and weighted copy fit in ``budget`` bytes"""
+    per_pixel = channels * FLOAT_BYTES * (1 + 2 * scale * scale)
+    side = int(math.sqrt(max(budget, 0) / per_pixel)) // multiple * multiple
+    return max(minimum, side)
+
+
+def budget_overlap(tile: int) -> int:
+    """Overlap between neighbouring tiles, an eighth of the tile in steps of 8 and between 8 and 64 pixels"""
+    return max(8, min(64, tile // 64 * 8))
+
+
+def tile_spans(length: int, tile: int, overlap: int) -> List[Tuple[int, int]]:
+    """Evenly spread ``(start, end)`` spans of ``tile`` pixels covering ``length``, overlapping by ``overlap`` or more"""
+    if length <= tile:
+        return [(0, length)]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    stride = (length - tile) / (count - 1)
+    return [(round(i * stride), round(i * stride) + tile) for i in range(count)]
+
+
+def feather_weights(spans: Sequence[Tuple[int, int]], length: int, ramp: int, scale: int = 1) -> List[torch.Tensor]:
+    """1-D blend weight of every span, scaled by ``scale``, that sum to one at every position of ``length * scale``.
+
+    Each span ramps up over ``ramp`` output pixels from an edge it shares with a neighbour and down towards the
+    next one, the ramps are then normalised by their sum so irregular overlaps still blend to exactly one.
+    The outer product of a row and a column weight is the 2-D weight of a tile.
+    """
+    raw = []
+    total = torch.zeros(length * scale)
+    for start, end in spans:
+        start, end = start * scale, end * scale
+        weight = torch.ones(end - start)
+        steps = min(ramp, (end - start) // 2)
+        if steps > 0:
+            rise = (torch.arange(steps, dtype=torch.float32) + 0.5) / steps
+            if start > 0:
+                weight[:steps] = rise
+            if end < length * scale:
+                weight[-steps:] = torch.minimum(weight[-steps:], rise.flip(0))
+        raw.append(weight)
+        total[start:end] += weight
+    return [weight / total[start * scale:end * scale] for weight, (start, end) in zip(raw, spans)]
+
+
+def allocate_output(shape: Sequence[int], mmap_dir: Optional[str] = None) -> torch.Tensor:
+    """Zeroed float32 tensor of ``shape``, backed by an unlinked temporary file in ``mmap_dir`` when it is given.
+
+    A file backed tensor lets the OS page finished frames out to disk, so outputs larger than RAM still fit.
+    """
+    if mmap_dir is None:
+        return torch.zeros(tuple(shape), dtype=torch.float32)
+
+    numel = math.prod(shape)
+    fd, path = tempfile.mkstemp(suffix='.f32', dir=mmap_dir)
+    try:
+        os.ftruncate(fd, numel * FLOAT_BYTES)
+    finally:
+        os.close(fd)
+    output = torch.from_file(path, shared=True, size=numel, dtype=torch.float32).view(tuple(shape))
+    try:
+        # The mapping keeps the data alive, removing the name frees the disk space once the tensor is released
+        os.remove(path)
+    except OSError:
+        pass
+    return output
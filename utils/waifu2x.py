@@ -0,0 +1,287 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+
+import torch
+
+from typing import Dict, List, Optional
+from .cache import LRUCache
+from .directory import initialize_directory
+
+WAIFU2X_REPO = 'nagadomi/nunif:dev'
+# Set to 1 to let the node fetch WAIFU2X_REPO from GitHub through torch.hub when there is no local install
+HUB_FALLBACK_ENV = 'SHIBIKO_WAIFU2X_HUB'
+
+# Layout of the pinned install under models/waifu2x, written by scripts/install_waifu2x.py
+LOCK_FILE = 'waifu2x.lock.json'
+CODE_DIR = 'nunif'
+HUB_DIR = 'hub'
+
+_local_lock = threading.Lock()
+_local_checked = False
+_local_code = None
+
+
+def _release(key, model):
+    if key[4].startswith('cuda'):
+        torch.cuda.empty_cache()
+
+
+# Waifu2x models shared by every node in the process, keyed by
+# (model_type, method, noise_level, amp, device, tile_size, batch_size, channels_last, compiled)
+WAIFU2X_CACHE = LRUCache(maxsize=4, on_evict=_release)
+
+
+def waifu2x_device(device: Optional[str] = None) -> str:
+    """``device`` itself, or CUDA when it is available and the CPU otherwise"""
+    if device and device != 'auto':
+        return device
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def waifu2x_home() -> str:
+    """models/waifu2x, created with its README on first use"""
+    return initialize_directory('waifu2x')
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_tree(home: str) -> Dict[str, str]:
+    """sha256 of every file of the install, keyed by its '/' separated path relative to ``home``"""
+    hashes = {}
+    for directory in (CODE_DIR, HUB_DIR):
+        for root, dirs, files in os.walk(os.path.join(home, directory)):
+            dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                hashes[os.path.relpath(path, home).replace(os.sep, '/')] = hash_file(path)
+    return hashes
+
+
+def verify_install(home: str) -> Dict:
+    """Check every file listed in the lock file against its sha256 and return the lock.
+
+    Raises RuntimeError naming the missing or modified files.
+    """
+    with open(os.path.join(home, LOCK_FILE)) as f:
+        lock = json.load(f)
+    bad = []
+    for name, expected in lock['files'].items():
+        path = os.path.join(home, *name.split('/'))
+        if not os.path.isfile(path) or hash_file(path) != expected:
+            bad.append(name)
+    if bad:
+        listed = ', '.join(bad[:5]) + (f' and {len(bad) - 5} more' if len(bad) > 5 else '')
+        raise RuntimeError(f'waifu2x install in {home} does not match {LOCK_FILE}: {listed}. '
+                           f'Run scripts/install_waifu2x.py again.')
+    return lock
+
+
+def local_waifu2x() -> Optional[str]:
+    """Code directory of the verified local install, or None when there is none. Checked once per process."""
+    global _local_checked, _local_code
+    with _local_lock:
+        if not _local_checked:
+            home = waifu2x_home()
+            if os.path.isfile(os.path.join(home, LOCK_FILE)):
+                lock = verify_install(home)
+                _local_code = os.path.join(home, CODE_DIR)
+                print(f'\033[93m[Shibiko AI] \033[31mUsing waifu2x {lock["repo"]}@{lock["commit"][:12]} '
+                      f'from {home}\033[0m')
+            elif hub_fallback():
+                print(f'\033[93m[Shibiko AI] \033[31mNo local waifu2x install in {home}, loading {WAIFU2X_REPO} '
+                      f'through torch.hub since {HUB_FALLBACK_ENV} is set.\033[0m')
+            else:
+                raise RuntimeError(f'No waifu2x install in {home}. Run scripts/install_waifu2x.py to install a '
+                                   f'pinned copy, or set {HUB_FALLBACK_ENV}=1 to load {WAIFU2X_REPO} from GitHub.')
+            _local_checked = True
+    return _local_code
+
+
+def hub_fallback() -> bool:
+    """Whether loading ``WAIFU2X_REPO`` from GitHub was opted into with the ``SHIBIKO_WAIFU2X_HUB`` variable"""
+    return os.environ.get(HUB_FALLBACK_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+@contextlib.contextmanager
+def hub_dir(directory: str):
+    """Point torch.hub's download cache at ``directory`` for the duration of the block.
+
+    The exact previous setting is put back afterwards, including none at all, so torch.hub keeps following
+    ``$TORCH_HOME`` when nothing had called ``set_dir`` before.
+    """
+    previous = torch.hub._hub_dir
+    torch.hub.set_dir(directory)
+    try:
+        yield directory
+    finally:
+        torch.hub._hub_dir = previous
+
+
+def hub_load(code: Optional[str] = None, **kwargs):
+    """nunif's waifu2x hub entry point from the local install at ``code``, or from GitHub when it is None.
+
+    Weights the entry point fetches through torch.hub are read from the install's own hub directory. Loading from
+    GitHub has to be opted into with ``SHIBIKO_WAIFU2X_HUB=1``, otherwise a RuntimeError points at the install script.
+    """
+    if code is None:
+        if not hub_fallback():
+            raise RuntimeError(f'No local waifu2x install given. Run scripts/install_waifu2x.py, or set '
+                               f'{HUB_FALLBACK_ENV}=1 to load {WAIFU2X_REPO} from GitHub.')
+        return torch.hub.load(WAIFU2X_REPO, 'waifu2x', trust_repo=True, **kwargs)
+    with hub_dir(os.path.join(os.path.dirname(code), HUB_DIR)):
+        return torch.hub.load(code, 'waifu2x', source='local', **kwargs)
+
+
+def waifu2x_modules(model, depth: int = 3) -> List[torch.nn.Module]:
+    """The torch modules inside nunif's model wrapper, or the model itself when it is one.
+
+    nunif keeps its networks on helper objects below the hub wrapper, so attributes, dicts, lists and tuples are
+    searched up to ``depth`` levels down. A module found is returned whole, its own children are not listed again.
+    """
+    modules, seen = [], set()
+
+    def visit(value, level):
+        if id(value) in seen:
+            return
+        seen.add(id(value))
+        if isinstance(value, torch.nn.Module):
+            modules.append(value)
+        elif level < depth:
+            if isinstance(value, dict):
+                children = value.values()
+            elif isinstance(value, (list, tuple)):
+                children = value
+            else:
+                children = getattr(value, '__dict__', {}).values()
+            for child in children:
+                visit(child, level + 1)
+
+    visit(model, 0)
+    return modules
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether oneDNN has native bfloat16 kernels on this CPU (AVX512-BF16 or AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+@contextlib.contextmanager
+def intra_op_threads(threads: int):
+    """Pin torch's process-wide intra-op thread pool to ``threads`` inside the block, 0 leaves it alone.
+
+    The previous count is restored on exit so other nodes in the process are not affected.
+    """
+    previous = torch.get_num_threads()
+    if threads > 0 and previous != threads:
+        torch.set_num_threads(threads)
+    try:
+        yield
+    finally:
+        if torch.get_num_threads() != previous:
+            torch.set_num_threads(previous)
+
+
+_bf16_warned = set()
+
+
+def infer(model, x: torch.Tensor, method: Optional[str], noise_level: int, bf16: bool = False) -> torch.Tensor:
+    """One CHW float image through the model's tiled inference, returned as float32 CHW.
+
+    Runs under inference mode. With ``bf16`` the model should have been loaded with it (see ``get_waifu2x``), and the
+    call also runs under a CPU bfloat16 autocast. The networks' outputs are watched, and a warning is printed once per
+    model if they still come out in float32.
+    """
+    bf16 = bf16 and x.device.type == 'cpu'
+    dtypes, handles = set(), []
+    if bf16 and id(model) not in _bf16_warned:
+        for module in waifu2x_modules(model):
+            handles.append(module.register_forward_hook(
+                lambda module, inputs, output: dtypes.add(output.dtype) if torch.is_tensor(output) else None))
+    try:
+        with torch.inference_mode(), torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+            z = model.infer(x, method=method, noise_level=noise_level, output_type='tensor')
+    finally:
+        for handle in handles:
+            handle.remove()
+    if handles:
+        _bf16_warned.add(id(model))
+        if torch.bfloat16 not in dtypes:
+            print('\033[93m[Shibiko AI] \033[31mwaifu2x still ran in float32 with cpu_bf16 on, '
+                  'this nunif version does not autocast on the CPU\033[0m')
+    return z.float()
+
+
+def get_waifu2x(model_type: str = 'art', method: Optional[str] = 'noise', noise_level: int = 3, amp: bool = False,
+                device: Optional[str] = None, batch_size: int = 1, keep_alpha: bool = True, tile_size: int = 256,
+                channels_last: bool = False, compiled: bool = False, bf16: bool = False,
+                max_models: Optional[int] = None):
+    """Cached waifu2x model set to ``method`` and ``noise_level``, loaded on first use.
+
+    ``amp`` is nunif's own mixed precision. On CUDA it is taken as given; on the CPU it is only turned on by ``bf16``
+    (where the CPU has native bfloat16), since nunif's autocast on the CPU runs in bfloat16. An outer autocast alone
+    would be switched off again by nunif's own ``autocast(enabled=amp)`` around its tiles.
+    ``channels_last`` converts the weights to the NHWC layout oneDNN's convolutions are fastest with, and
+    ``compiled`` compiles every module with torch.compile; both are part of the key, so each variant is only built
+    once. ``max_models`` resizes the cache first, unloading the least recently used models beyond it.
+    """
+    device = waifu2x_device(device)
+    amp = bool(amp) if device.startswith('cuda') else bool(bf16) and cpu_supports_bf16()
+    if max_models is not None and max_models != WAIFU2X_CACHE.maxsize:
+        WAIFU2X_CACHE.resize(max_models)
+
+    def load():
+        print(f'\033[93m[Shibiko AI] \033[31mLoading waifu2x {model_type} {method} noise {noise_level} '
+              f'on {device}\033[0m')
+        model = hub_load(
+            local_waifu2x(),
+            model_type=model_type,
+            method=method,
+            noise_level=noise_level,
+            device_ids=[torch.device(device).index or 0] if device.startswith('cuda') else [-1],
+            batch_size=batch_size,
+            tile_size=tile_size,
+            keep_alpha=keep_alpha,
+            amp=amp,
+        ).to(device)
+        model.set_mode(method=method, noise_level=noise_level)
+        modules = waifu2x_modules(model)
+        if (channels_last or compiled) and not modules:
+            print('\033[93m[Shibiko AI] \033[31mNo torch modules found in the waifu2x model, '
+                  'cpu_channels_last and cpu_compile have no effect\033[0m')
+        for module in modules:
+            if channels_last:
+                module.to(memory_format=torch.channels_last)
+            if compiled:
+                module.compile()
+        return model
+
+    key = (model_type, method, noise_level, amp, device, tile_size, batch_size, channels_last, compiled)
+    return WAIFU2X_CACHE.get(key, load)
+
+
+def unload_waifu2x(model_type: Optional[str] = None):
+    """Drop every cached model, or only the models of ``model_type``"""
+    if model_type is None:
+        WAIFU2X_CACHE.clear()
+        return
+    for key in WAIFU2X_CACHE.keys():
+        if key[0] == model_type:
+            WAIFU2X_CACHE.pop(key)
+
+
+def waifu2x_stats() -> Dict:
+    stats = WAIFU2X_CACHE.stats()
+    stats['models'] = WAIFU2X_CACHE.keys()
+    return stats